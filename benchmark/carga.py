@@ -0,0 +1,250 @@
+"""
+Generador de carga para /clasificar_gasto.
+
+Reproduce un corpus de mensajes a una tasa fija (--rps, lazo abierto) o con
+N clientes concurrentes (--concurrencia, lazo cerrado) y guarda un JSON con
+latencias p50/p95/p99, throughput, tasa de error y llamadas al LLM por
+petición, para comparar entre commits (--base resultado_anterior.json).
+
+    python -m benchmark.carga --url http://127.0.0.1:9100 --rps 50 --duracion 30 \
+        --groq-url http://127.0.0.1:9101 --salida benchmark/resultados/actual.json
+"""
+from datetime import datetime
+from pathlib import Path
+import argparse
+import asyncio
+import httpx
+import json
+import math
+import random
+import re
+import subprocess
+import time
+
+CORPUS_DEFECTO = Path(__file__).with_name("mensajes.txt")
+PATRON_MONTO = re.compile(r"\d+(?:[.,]\d+)?")
+
+
+def cargar_corpus(ruta: Path) -> list[str]:
+    return [linea.strip() for linea in ruta.read_text(encoding="utf-8").splitlines() if linea.strip()]
+
+
+def variar_monto(mensaje: str) -> str:
+    """Cambia el monto para que la caché no vea siempre el mismo texto literal."""
+    return PATRON_MONTO.sub(lambda _: str(random.randint(10, 5000)), mensaje, count=1)
+
+
+def percentil(valores: list[float], p: float) -> float | None:
+    """Rango más cercano: el menor valor con al menos p% de las muestras a su izquierda o igual."""
+    if not valores:
+        return None
+    ordenados = sorted(valores)
+    indice = min(max(math.ceil(p / 100 * len(ordenados)) - 1, 0), len(ordenados) - 1)
+    return ordenados[indice]
+
+
+def commit_actual() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except Exception:
+        return None
+
+
+async def obtener_json(cliente: httpx.AsyncClient, url: str | None) -> dict | None:
+    if not url:
+        return None
+    try:
+        res = await cliente.get(url)
+        return res.json()
+    except Exception:
+        return None
+
+
+# ==============================
+# EJECUCIÓN
+# ==============================
+async def una_peticion(cliente: httpx.AsyncClient, args, corpus: list[str], muestras: list):
+
+    mensaje = random.choice(corpus)
+    if args.variar_montos:
+        mensaje = variar_monto(mensaje)
+
+    inicio = time.perf_counter()
+    try:
+        res = await cliente.post(
+            f"{args.url}/clasificar_gasto",
+            json={"mensaje": mensaje},
+            headers={"Authorization": f"Bearer {args.token}"}
+        )
+        estado = res.status_code
+        degradado = res.is_success and res.json().get("degradado", False)
+    except Exception as e:
+        estado, degradado = type(e).__name__, False
+
+    muestras.append((time.perf_counter() - inicio, estado, degradado))
+
+
+async def lazo_abierto(cliente, args, corpus, muestras):
+    """Una petición cada 1/rps segundos, sin esperar a que terminen las anteriores."""
+    intervalo = 1 / args.rps
+    fin = time.perf_counter() + args.duracion
+    siguiente = time.perf_counter()
+    tareas = set()
+
+    while siguiente < fin:
+        tarea = asyncio.create_task(una_peticion(cliente, args, corpus, muestras))
+        tareas.add(tarea)
+        tarea.add_done_callback(tareas.discard)
+
+        siguiente += intervalo
+        await asyncio.sleep(max(siguiente - time.perf_counter(), 0))
+
+    await asyncio.gather(*tareas)
+
+
+async def lazo_cerrado(cliente, args, corpus, muestras):
+    """N clientes que mandan la siguiente petición en cuanto reciben respuesta."""
+    fin = time.perf_counter() + args.duracion
+
+    async def usuario():
+        while time.perf_counter() < fin:
+            await una_peticion(cliente, args, corpus, muestras)
+
+    await asyncio.gather(*(usuario() for _ in range(args.concurrencia)))
+
+
+async def ejecutar(args) -> dict:
+
+    corpus = cargar_corpus(Path(args.corpus))
+    muestras: list[tuple[float, int | str, bool]] = []
+    limites = httpx.Limits(max_connections=1000, max_keepalive_connections=200)
+
+    async with httpx.AsyncClient(timeout=args.timeout, limits=limites) as cliente:
+        groq_antes = await obtener_json(cliente, args.groq_url and f"{args.groq_url}/estadisticas")
+
+        inicio = time.perf_counter()
+        if args.rps:
+            await lazo_abierto(cliente, args, corpus, muestras)
+        else:
+            await lazo_cerrado(cliente, args, corpus, muestras)
+        transcurrido = time.perf_counter() - inicio
+
+        groq_despues = await obtener_json(cliente, args.groq_url and f"{args.groq_url}/estadisticas")
+        niveles = await obtener_json(cliente, f"{args.url}/clasificador/estadisticas")
+        groq_estado = await obtener_json(cliente, f"{args.url}/groq/estado")
+
+    total = len(muestras)
+    latencias_ms = [m[0] * 1000 for m in muestras]
+    # 400 es una respuesta válida (mensaje ofensivo o sin monto), no un error del servicio
+    errores = sum(1 for m in muestras if not isinstance(m[1], int) or m[1] >= 500 or m[1] in (401, 429))
+    por_estado: dict[str, int] = {}
+    for _, estado, _ in muestras:
+        por_estado[str(estado)] = por_estado.get(str(estado), 0) + 1
+
+    degradadas = sum(1 for m in muestras if m[2])
+
+    llamadas_llm = None
+    if groq_antes and groq_despues:
+        llamadas_llm = groq_despues["peticiones"] - groq_antes["peticiones"]
+
+    return {
+        "fecha": datetime.now().isoformat(timespec="seconds"),
+        "commit": commit_actual(),
+        "config": {
+            "modo": "rps" if args.rps else "concurrencia",
+            "rps": args.rps,
+            "concurrencia": args.concurrencia,
+            "duracion": args.duracion,
+            "corpus": str(args.corpus),
+            "variar_montos": args.variar_montos
+        },
+        "peticiones": total,
+        "segundos": round(transcurrido, 3),
+        "throughput_rps": round(total / transcurrido, 2) if transcurrido else 0,
+        "tasa_error": round(errores / total, 4) if total else 0,
+        "degradadas": degradadas,
+        "fraccion_degradadas": round(degradadas / total, 4) if total else 0,
+        "por_estado": por_estado,
+        "latencia_ms": {
+            "p50": percentil(latencias_ms, 50),
+            "p95": percentil(latencias_ms, 95),
+            "p99": percentil(latencias_ms, 99),
+            "max": max(latencias_ms) if latencias_ms else None,
+            "media": sum(latencias_ms) / total if total else None
+        },
+        "llamadas_llm": llamadas_llm,
+        "llamadas_llm_por_peticion": round(llamadas_llm / total, 3) if llamadas_llm is not None and total else None,
+        "niveles": niveles,
+        "groq": groq_estado
+    }
+
+
+# ==============================
+# REPORTE
+# ==============================
+def imprimir(resultado: dict, base: dict | None = None):
+
+    def delta(actual, anterior):
+        if actual is None or not anterior:
+            return ""
+        return f"  ({(actual - anterior) / anterior * 100:+.1f}%)"
+
+    def delta_puntos(actual, anterior):
+        # Para fracciones que pueden valer 0: diferencia en puntos porcentuales
+        if actual is None or anterior is None:
+            return ""
+        return f"  ({(actual - anterior) * 100:+.1f} pp)"
+
+    lat = resultado["latencia_ms"]
+    lat_base = (base or {}).get("latencia_ms", {})
+
+    print(f"peticiones      {resultado['peticiones']} en {resultado['segundos']}s")
+    print(f"throughput      {resultado['throughput_rps']} req/s" + delta(resultado["throughput_rps"], (base or {}).get("throughput_rps")))
+    for p in ("p50", "p95", "p99"):
+        valor = lat[p]
+        texto = f"{valor:.1f} ms" if valor is not None else "-"
+        print(f"latencia {p}    {texto}" + delta(valor, lat_base.get(p)))
+    print(f"tasa de error   {resultado['tasa_error']:.2%}   estados: {resultado['por_estado']}")
+    print(f"degradadas      {resultado['degradadas']} ({resultado['fraccion_degradadas']:.2%})"
+          + delta_puntos(resultado["fraccion_degradadas"], (base or {}).get("fraccion_degradadas")))
+    print(f"llamadas LLM    {resultado['llamadas_llm']} ({resultado['llamadas_llm_por_peticion']} por petición)"
+          + delta(resultado["llamadas_llm_por_peticion"], (base or {}).get("llamadas_llm_por_peticion")))
+
+
+def argumentos(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://127.0.0.1:9100", help="URL base de la app")
+    parser.add_argument("--groq-url", default=None, help="URL del Groq falso, para contar llamadas al LLM")
+    parser.add_argument("--corpus", default=str(CORPUS_DEFECTO))
+    modo = parser.add_mutually_exclusive_group()
+    modo.add_argument("--rps", type=float, default=None, help="Tasa objetivo (lazo abierto)")
+    modo.add_argument("--concurrencia", type=int, default=10, help="Clientes simultáneos (lazo cerrado)")
+    parser.add_argument("--duracion", type=float, default=30, help="Segundos de carga")
+    parser.add_argument("--timeout", type=float, default=30)
+    parser.add_argument("--token", default="benchmark")
+    parser.add_argument("--sin-variar-montos", dest="variar_montos", action="store_false")
+    parser.add_argument("--salida", default=None, help="Archivo JSON con el resultado")
+    parser.add_argument("--base", default=None, help="Resultado anterior para comparar")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = argumentos(argv)
+    resultado = asyncio.run(ejecutar(args))
+
+    base = json.loads(Path(args.base).read_text()) if args.base else None
+    imprimir(resultado, base)
+
+    if args.salida:
+        Path(args.salida).parent.mkdir(parents=True, exist_ok=True)
+        Path(args.salida).write_text(json.dumps(resultado, indent=2, ensure_ascii=False))
+        print(f"resultado guardado en {args.salida}")
+
+    return resultado
+
+
+if __name__ == "__main__":
+    main()
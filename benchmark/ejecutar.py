@@ -0,0 +1,100 @@
+"""
+Corre el benchmark completo sin red: levanta el Groq falso, el backend falso
+y la app (uvicorn), lanza la carga y apaga todo al terminar.
+
+    python -m benchmark.ejecutar --rps 40 --duracion 30 --salida benchmark/resultados/actual.json
+    python -m benchmark.ejecutar --concurrencia 50 --base benchmark/resultados/actual.json
+
+Los argumentos que no reconoce se pasan tal cual a benchmark.carga. Variables
+FAKE_GROQ_* / FAKE_BACKEND_* y las de la app (MODO_CLASIFICACION, CACHE_BACKEND,
+...) se heredan del entorno. GROQ_LIMITE_RPM, si no se da, se sube para medir
+la cascada y no el limitador; para medir el limitador, fíjalo (y FAKE_GROQ_LIMITE_RPM).
+"""
+from contextlib import contextmanager
+from pathlib import Path
+import argparse
+import httpx
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmark import carga
+
+RAIZ = Path(__file__).resolve().parent.parent
+
+
+def esperar_listo(url: str, proceso: subprocess.Popen, limite: float = 20):
+    fin = time.monotonic() + limite
+    while time.monotonic() < fin:
+        if proceso.poll() is not None:
+            raise RuntimeError(f"El proceso de {url} terminó con código {proceso.returncode}")
+        try:
+            httpx.get(url, timeout=1)
+            return
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    raise RuntimeError(f"{url} no respondió en {limite}s")
+
+
+@contextmanager
+def servidor(app: str, puerto: int, entorno: dict, ruta_salud: str, workers: int = 1):
+    comando = [
+        sys.executable, "-m", "uvicorn", app,
+        "--host", "127.0.0.1", "--port", str(puerto),
+        "--workers", str(workers), "--log-level", "warning"
+    ]
+    proceso = subprocess.Popen(comando, cwd=RAIZ, env=entorno)
+    try:
+        esperar_listo(f"http://127.0.0.1:{puerto}{ruta_salud}", proceso)
+        yield proceso
+    finally:
+        proceso.terminate()
+        try:
+            proceso.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            proceso.kill()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--puerto-app", type=int, default=9100)
+    parser.add_argument("--puerto-groq", type=int, default=9101)
+    parser.add_argument("--puerto-backend", type=int, default=9102)
+    parser.add_argument("--workers", type=int, default=1, help="Workers de uvicorn para la app")
+    args, resto = parser.parse_known_args()
+
+    url_groq = f"http://127.0.0.1:{args.puerto_groq}"
+    url_backend = f"http://127.0.0.1:{args.puerto_backend}"
+    url_app = f"http://127.0.0.1:{args.puerto_app}"
+
+    with tempfile.TemporaryDirectory(prefix="benchmark_") as tmp:
+        entorno = os.environ.copy()
+        entorno_app = {
+            **entorno,
+            "GROQ_API_KEY": "falsa",
+            "GROQ_BASE_URL": url_groq,
+            "BACKEND_URL": f"{url_backend}/transacciones",
+            # Cada corrida empieza con caché, outbox e índice de categorías vacíos
+            "OUTBOX_RUTA": str(Path(tmp) / "outbox.db"),
+            "CACHE_SQLITE_RUTA": str(Path(tmp) / "cache.db"),
+            "INDICE_CATEGORIAS_RUTA": str(Path(tmp) / "categorias.db"),
+            "GROQ_LIMITE_RPM": entorno.get("GROQ_LIMITE_RPM", "100000"),
+            "LOG_NIVEL": entorno.get("LOG_NIVEL", "WARNING")
+        }
+
+        with servidor("benchmark.fake_groq:app", args.puerto_groq, entorno, "/estadisticas"), \
+             servidor("benchmark.fake_backend:app", args.puerto_backend, entorno, "/estadisticas"), \
+             servidor("main:app", args.puerto_app, entorno_app, "/", workers=args.workers):
+
+            resultado = carga.main(["--url", url_app, "--groq-url", url_groq, *resto])
+
+            backend = httpx.get(f"{url_backend}/estadisticas").json()
+            print(f"backend recibió {backend}")
+
+    return resultado
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,39 @@
+"""
+Backend falso que recibe las transacciones de BACKEND_URL y sólo las cuenta.
+
+    FAKE_BACKEND_LATENCIA_MS=20 uvicorn benchmark.fake_backend:app --port 9102
+"""
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+import asyncio
+import os
+import random
+
+LATENCIA_MS = float(os.getenv("FAKE_BACKEND_LATENCIA_MS", "20"))
+TASA_ERROR = float(os.getenv("FAKE_BACKEND_TASA_ERROR", "0"))
+
+app = FastAPI(title="Backend falso")
+
+estadisticas = {"peticiones": 0, "transacciones": 0, "errores": 0}
+
+
+@app.post("/transacciones")
+async def recibir(request: Request):
+
+    cuerpo = await request.json()
+    estadisticas["peticiones"] += 1
+
+    await asyncio.sleep(LATENCIA_MS / 1000)
+
+    if random.random() < TASA_ERROR:
+        estadisticas["errores"] += 1
+        return JSONResponse({"detail": "error simulado"}, status_code=503)
+
+    # La outbox manda una transacción o una lista (OUTBOX_TAMANO_LOTE > 1)
+    estadisticas["transacciones"] += len(cuerpo) if isinstance(cuerpo, list) else 1
+    return JSONResponse({"ok": True}, status_code=201)
+
+
+@app.get("/estadisticas")
+async def ver_estadisticas():
+    return estadisticas
@@ -0,0 +1,169 @@
+"""
+Servidor falso de Groq (chat completions) para pruebas de carga sin gastar cuota.
+
+    FAKE_GROQ_LATENCIA_MS=300 FAKE_GROQ_TASA_ERROR=0.02 FAKE_GROQ_LIMITE_RPM=600 \
+        uvicorn benchmark.fake_groq:app --port 9101
+
+La app se apunta aquí con GROQ_BASE_URL=http://127.0.0.1:9101 (lo lee el SDK).
+"""
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+from collections import deque
+import asyncio
+import json
+import os
+import random
+import re
+import time
+import uuid
+
+# ==============================
+# CONFIGURACIÓN
+# ==============================
+LATENCIA_MS = float(os.getenv("FAKE_GROQ_LATENCIA_MS", "300"))
+VARIACION_MS = float(os.getenv("FAKE_GROQ_VARIACION_MS", "100"))
+# Fracción de peticiones que responden 500
+TASA_ERROR = float(os.getenv("FAKE_GROQ_TASA_ERROR", "0"))
+# Peticiones por minuto antes de responder 429 (0 = sin límite)
+LIMITE_RPM = int(os.getenv("FAKE_GROQ_LIMITE_RPM", "0"))
+TOKENS_POR_MINUTO = int(os.getenv("FAKE_GROQ_LIMITE_TPM", "0"))
+
+app = FastAPI(title="Groq falso")
+
+ventana: deque[float] = deque()
+tokens_ventana: deque[tuple[float, int]] = deque()
+estadisticas = {"peticiones": 0, "respondidas": 0, "errores": 0, "limitadas": 0, "prompt_tokens": 0, "completion_tokens": 0}
+
+
+# ==============================
+# RESPUESTAS SIMULADAS
+# ==============================
+PALABRAS_INGRESO = ("pagaron", "depositaron", "quincena", "sueldo", "nomina", "nómina", "cobré", "vendí", "recibí")
+PALABRAS_OFENSIVAS = ("puta", "pendej", "chinga", "verga", "cabrón", "cabron", "mierda")
+CATEGORIAS = {
+    "uber": "Transporte", "didi": "Transporte", "gasolina": "Gasolina", "oxxo": "Tienda",
+    "walmart": "Supermercado", "netflix": "Streaming", "renta": "Renta", "tacos": "Comida",
+    "farmacia": "Farmacia", "quincena": "Salario", "sueldo": "Salario", "cine": "Entretenimiento"
+}
+
+
+def analizar(mensaje: str) -> dict:
+    texto = mensaje.lower()
+    categoria = next((c for palabra, c in CATEGORIAS.items() if palabra in texto), "Varios")
+    return {
+        "ofensivo": any(p in texto for p in PALABRAS_OFENSIVAS),
+        "doble_sentido": "chile" in texto or "huevos" in texto,
+        "type": "income" if any(p in texto for p in PALABRAS_INGRESO) else "expense",
+        "categoria": categoria
+    }
+
+
+def contenido_para(prompt: str) -> str:
+    """Reconoce el prompt de main.py por las claves JSON que pide y responde igual."""
+
+    if '"resultados"' in prompt:
+        entrada = json.loads(prompt.split("Mensajes:", 1)[1].strip())
+        return json.dumps({"resultados": [{"id": m["id"], **analizar(m["mensaje"])} for m in entrada]})
+
+    match = re.search(r'Mensaje: "(.*)"', prompt, re.S)
+    analisis = analizar(match.group(1) if match else prompt)
+
+    if '"ofensivo"' in prompt and '"categoria"' in prompt:
+        return json.dumps(analisis)
+    if '"ofensivo"' in prompt:
+        return json.dumps({"ofensivo": analisis["ofensivo"]})
+    if '"doble_sentido"' in prompt:
+        return json.dumps({"doble_sentido": analisis["doble_sentido"]})
+    if '"type"' in prompt:
+        return json.dumps({"type": analisis["type"]})
+    return json.dumps({"categoria": analisis["categoria"]})
+
+
+def limpiar_ventanas(ahora: float):
+    while ventana and ventana[0] <= ahora - 60:
+        ventana.popleft()
+    while tokens_ventana and tokens_ventana[0][0] <= ahora - 60:
+        tokens_ventana.popleft()
+
+
+def cabeceras_limite(ahora: float) -> dict:
+    cabeceras = {}
+    if LIMITE_RPM:
+        reinicio = 60 - (ahora - ventana[0]) if ventana else 0
+        cabeceras["x-ratelimit-limit-requests"] = str(LIMITE_RPM)
+        cabeceras["x-ratelimit-remaining-requests"] = str(max(LIMITE_RPM - len(ventana), 0))
+        cabeceras["x-ratelimit-reset-requests"] = f"{reinicio:.2f}s"
+    if TOKENS_POR_MINUTO:
+        usados = sum(t for _, t in tokens_ventana)
+        reinicio = 60 - (ahora - tokens_ventana[0][0]) if tokens_ventana else 0
+        cabeceras["x-ratelimit-limit-tokens"] = str(TOKENS_POR_MINUTO)
+        cabeceras["x-ratelimit-remaining-tokens"] = str(max(TOKENS_POR_MINUTO - usados, 0))
+        cabeceras["x-ratelimit-reset-tokens"] = f"{reinicio:.2f}s"
+    return cabeceras
+
+
+# ==============================
+# ENDPOINTS
+# ==============================
+@app.post("/openai/v1/chat/completions")
+async def chat_completions(request: Request):
+
+    cuerpo = await request.json()
+    prompt = cuerpo["messages"][-1]["content"]
+    estadisticas["peticiones"] += 1
+
+    ahora = time.time()
+    limpiar_ventanas(ahora)
+
+    tokens_usados = sum(t for _, t in tokens_ventana)
+    if (LIMITE_RPM and len(ventana) >= LIMITE_RPM) or (TOKENS_POR_MINUTO and tokens_usados >= TOKENS_POR_MINUTO):
+        estadisticas["limitadas"] += 1
+        espera = 60 - (ahora - ventana[0]) if ventana else 1
+        return JSONResponse(
+            {"error": {"message": "Rate limit reached", "type": "tokens", "code": "rate_limit_exceeded"}},
+            status_code=429,
+            headers={"retry-after": str(max(round(espera), 1)), **cabeceras_limite(ahora)}
+        )
+
+    ventana.append(ahora)
+
+    latencia = max(LATENCIA_MS + random.uniform(-VARIACION_MS, VARIACION_MS), 0) / 1000
+    await asyncio.sleep(latencia)
+
+    if random.random() < TASA_ERROR:
+        estadisticas["errores"] += 1
+        return JSONResponse({"error": {"message": "Internal server error", "type": "internal_server_error"}}, status_code=500)
+
+    contenido = contenido_para(prompt)
+    prompt_tokens = len(prompt) // 4
+    completion_tokens = len(contenido) // 4
+    tokens_ventana.append((time.time(), prompt_tokens + completion_tokens))
+
+    estadisticas["respondidas"] += 1
+    estadisticas["prompt_tokens"] += prompt_tokens
+    estadisticas["completion_tokens"] += completion_tokens
+
+    return JSONResponse(
+        {
+            "id": f"chatcmpl-{uuid.uuid4().hex}",
+            "object": "chat.completion",
+            "created": int(ahora),
+            "model": cuerpo.get("model", "llama-3.1-8b-instant"),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": contenido},
+                "finish_reason": "stop"
+            }],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens
+            }
+        },
+        headers=cabeceras_limite(time.time())
+    )
+
+
+@app.get("/estadisticas")
+async def ver_estadisticas():
+    return estadisticas
@@ -1,11 +1,32 @@
-from fastapi import FastAPI, Header, HTTPException
-from pydantic import BaseModel
+from fastapi import FastAPI, Header, HTTPException, Request
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from pydantic import BaseModel, ConfigDict, Field, ValidationError
+from typing import Literal
+from contextlib import asynccontextmanager, contextmanager
+from abc import ABC, abstractmethod
+from collections import OrderedDict, defaultdict
+from bisect import bisect_left
 from datetime import datetime
-import requests
+import asyncio
+import atexit
+import codecs
+import csv
+import hashlib
+import hmac
+import httpx
+import logging
+import logging.handlers
 import os
+import queue
+import random
 import re
 import json
+import sqlite3
+import sys
+import threading
+import time
 import unicodedata
+import uuid
 from dotenv import load_dotenv
 
 # ==============================
@@ -13,31 +34,223 @@ from dotenv import load_dotenv
 # ==============================
 load_dotenv()
 
+# ==============================
+# LOGS
+# ==============================
+LOG_NIVEL = os.getenv("LOG_NIVEL", "INFO").strip().upper()
+# Fracción de los mensajes DEBUG (ruta caliente) que se escriben
+LOG_MUESTREO = float(os.getenv("LOG_MUESTREO", "0.1"))
+
+
+class FiltroMuestreo(logging.Filter):
+    """Deja pasar sólo una fracción de los mensajes DEBUG; el resto completo."""
+
+    def __init__(self, tasa: float):
+        super().__init__()
+        self.tasa = tasa
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        return record.levelno > logging.DEBUG or random.random() < self.tasa
+
+
+def configurar_logs() -> logging.Logger:
+    """
+    El event loop sólo deja el registro en una cola; la escritura a stdout
+    la hace el hilo del QueueListener, así los logs no frenan las peticiones.
+    """
+    logger = logging.getLogger("ia_financiera")
+    if logger.handlers:
+        return logger
+
+    cola = queue.SimpleQueue()
+    salida = logging.StreamHandler(sys.stdout)
+    salida.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(message)s"))
+
+    oyente = logging.handlers.QueueListener(cola, salida)
+    oyente.start()
+    atexit.register(oyente.stop)
+
+    manejador = logging.handlers.QueueHandler(cola)
+    manejador.addFilter(FiltroMuestreo(LOG_MUESTREO))
+
+    logger.addHandler(manejador)
+    logger.setLevel(LOG_NIVEL)
+    logger.propagate = False
+    return logger
+
+
+log = configurar_logs()
+
 # ==============================
 # CONFIGURACIÓN DE GROQ
 # ==============================
+GROQ_MODELO = os.getenv("GROQ_MODELO", "llama-3.1-8b-instant")
+
+# Capa de llamadas: límite de peticiones, concurrencia (GROQ_MAX_CONCURRENCIA,
+# que depende del modo: ver la configuración de clasificación) y circuito
+GROQ_LIMITE_RPM = float(os.getenv("GROQ_LIMITE_RPM", "300"))
+# Si el limitador pide esperar más que esto, se usa el respaldo local
+GROQ_ESPERA_MAX = float(os.getenv("GROQ_ESPERA_MAX", "3"))
+# Con menos tokens restantes que esto se pausa hasta el reinicio de la ventana
+GROQ_MARGEN_TOKENS = int(os.getenv("GROQ_MARGEN_TOKENS", "500"))
+GROQ_CIRCUITO_FALLOS = int(os.getenv("GROQ_CIRCUITO_FALLOS", "5"))
+GROQ_CIRCUITO_ESPERA = float(os.getenv("GROQ_CIRCUITO_ESPERA", "30"))
+GROQ_TIMEOUT = float(os.getenv("GROQ_TIMEOUT", "15"))
+# USD por millón de tokens, para groq_costo_total (por defecto los de llama-3.1-8b-instant)
+GROQ_PRECIO_PROMPT = float(os.getenv("GROQ_PRECIO_PROMPT", "0.05"))
+GROQ_PRECIO_COMPLETION = float(os.getenv("GROQ_PRECIO_COMPLETION", "0.08"))
+
 try:
-    from groq import Groq
+    import groq
+    from groq import AsyncGroq
     GROQ_KEY = os.getenv("GROQ_API_KEY")
 
     if GROQ_KEY:
-        client = Groq(api_key=GROQ_KEY)
-        print("✅ Groq cargado correctamente")
+        # Los reintentos los decide la capa de llamadas, no el SDK
+        client = AsyncGroq(api_key=GROQ_KEY, max_retries=0, timeout=GROQ_TIMEOUT)
+        log.info("✅ Groq cargado correctamente")
     else:
-        print("❌ ERROR: GROQ_API_KEY no existe como variable de entorno")
+        log.error("❌ ERROR: GROQ_API_KEY no existe como variable de entorno")
         client = None
 
 except Exception as e:
-    print("❌ No se pudo inicializar Groq:", e)
+    log.error("❌ No se pudo inicializar Groq: %s", e)
     client = None
 
 
+# ==============================
+# CONFIGURACIÓN DE CLASIFICACIÓN
+# ==============================
+# "separado": una consulta a Groq por cada campo (ofensivo, doble sentido, tipo, categoría)
+# "fusionado": una sola consulta que devuelve los cuatro campos
+MODO_CLASIFICACION = os.getenv("MODO_CLASIFICACION", "separado").strip().lower()
+
+if MODO_CLASIFICACION not in ("separado", "fusionado"):
+    log.warning("⚠ MODO_CLASIFICACION desconocido, se usa 'separado': %s", MODO_CLASIFICACION)
+    MODO_CLASIFICACION = "separado"
+
+# Llamadas a Groq que abre cada mensaje sin resolver: en modo separado las cuatro van a la vez
+CONSULTAS_POR_MENSAJE = 4 if MODO_CLASIFICACION == "separado" else 1
+# Tope de llamadas simultáneas a Groq, medido en mensajes para que el semáforo
+# no sea el cuello de botella. La tasa la pone GROQ_LIMITE_RPM: lo que pase de
+# ella espera al limitador (o va al respaldo tras GROQ_ESPERA_MAX), así que
+# subir este tope no rebasa el límite de Groq.
+GROQ_MENSAJES_EN_VUELO = int(os.getenv("GROQ_MENSAJES_EN_VUELO", "50"))
+GROQ_MAX_CONCURRENCIA = int(os.getenv("GROQ_MAX_CONCURRENCIA", str(GROQ_MENSAJES_EN_VUELO * CONSULTAS_POR_MENSAJE)))
+
+# Clasificación en lote: mensajes por consulta y presupuesto aproximado de tokens
+LOTE_MENSAJES_POR_PROMPT = int(os.getenv("LOTE_MENSAJES_POR_PROMPT", "20"))
+LOTE_PRESUPUESTO_TOKENS = int(os.getenv("LOTE_PRESUPUESTO_TOKENS", "2000"))
+LOTE_MAX_MENSAJES = int(os.getenv("LOTE_MAX_MENSAJES", "500"))
+
+# Importación de estados de cuenta: filas clasificándose a la vez
+IMPORTACION_CONCURRENCIA = int(os.getenv("IMPORTACION_CONCURRENCIA", "8"))
+
+ADVERTENCIA_DOBLE_SENTIDO = "El mensaje contiene doble sentido. Por favor, exprésate con claridad."
+
+# ==============================
+# CONFIGURACIÓN DE CACHÉ
+# ==============================
+# "memoria": por proceso | "sqlite": compartida entre workers | "ninguno": desactivada
+CACHE_BACKEND = os.getenv("CACHE_BACKEND", "memoria").strip().lower()
+CACHE_MAX_ENTRADAS = int(os.getenv("CACHE_MAX_ENTRADAS", "10000"))
+CACHE_TTL_SEGUNDOS = float(os.getenv("CACHE_TTL_SEGUNDOS", "86400"))
+CACHE_SQLITE_RUTA = os.getenv("CACHE_SQLITE_RUTA", "cache_clasificaciones.db")
+
+# ==============================
+# CONFIGURACIÓN DEL CLASIFICADOR LOCAL
+# ==============================
+# Confianza mínima para resolver sin consultar a Groq (>1 lo desactiva)
+UMBRAL_CONFIANZA_LOCAL = float(os.getenv("UMBRAL_CONFIANZA_LOCAL", "0.85"))
+# Confianza en "no ofensivo" cuando el mensaje trae palabras que ningún léxico
+# explica: la lista de groserías es corta, así que por defecto decide Groq
+CONFIANZA_LOCAL_NO_OFENSIVO = float(os.getenv("CONFIANZA_LOCAL_NO_OFENSIVO", "0.5"))
+
+
+# ==============================
+# CONFIGURACIÓN DEL ÍNDICE DE CATEGORÍAS POR USUARIO
+# ==============================
+# Comercio/palabra → categoría aprendido de cada usuario (":memory:" no persiste)
+INDICE_CATEGORIAS_RUTA = os.getenv("INDICE_CATEGORIAS_RUTA", "categorias_usuarios.db")
+# Límites por usuario; al pasarlos se olvida lo menos usado
+INDICE_MAX_TERMINOS = int(os.getenv("INDICE_MAX_TERMINOS", "2000"))
+INDICE_MAX_CATEGORIAS = int(os.getenv("INDICE_MAX_CATEGORIAS", "200"))
+INDICE_USUARIOS_EN_MEMORIA = int(os.getenv("INDICE_USUARIOS_EN_MEMORIA", "1000"))
+# Un término decide la categoría sin Groq con estos votos y esta proporción
+INDICE_VOTOS_MINIMOS = int(os.getenv("INDICE_VOTOS_MINIMOS", "2"))
+INDICE_PROPORCION_MINIMA = float(os.getenv("INDICE_PROPORCION_MINIMA", "0.8"))
+# Al llegar a este total un término parte sus votos a la mitad: los hábitos nuevos pueden ganar
+INDICE_VOTOS_MAX = int(os.getenv("INDICE_VOTOS_MAX", "32"))
+# Categorías más usadas del usuario que se le muestran a Groq para que las reutilice (0: ninguna)
+INDICE_CATEGORIAS_EN_PROMPT = int(os.getenv("INDICE_CATEGORIAS_EN_PROMPT", "20"))
+# Similitud de trigramas (Jaccard) para unir categorías y comercios mal escritos
+INDICE_SIMILITUD_CATEGORIA = float(os.getenv("INDICE_SIMILITUD_CATEGORIA", "0.5"))
+INDICE_SIMILITUD_TERMINO = float(os.getenv("INDICE_SIMILITUD_TERMINO", "0.6"))
+# Cada cuánto se relee de disco un usuario en memoria, para ver lo que aprendieron otros workers
+INDICE_RECARGA_SEGUNDOS = float(os.getenv("INDICE_RECARGA_SEGUNDOS", "30"))
+# Usuarios (tokens) sin actividad en este tiempo se borran del archivo al compactar
+INDICE_TTL_SEGUNDOS = float(os.getenv("INDICE_TTL_SEGUNDOS", str(30 * 86400)))
+
+
 # ==============================
 # CONFIGURACIÓN DEL BACKEND
 # ==============================
 BACKEND_URL = os.getenv("BACKEND_URL")
 
-app = FastAPI(title="IA Financiera - Groq Edition")
+# Cola local (outbox) donde se confirman las transacciones antes de enviarlas
+OUTBOX_RUTA = os.getenv("OUTBOX_RUTA", "outbox.db")
+# >1 envía hasta ese número de transacciones del mismo token en un solo POST
+# (lista JSON; el backend debe aceptarla). Las de un mismo /clasificar_gastos
+# van juntas, sin mezclarse con otras. Con 1, un POST por transacción (objeto)
+OUTBOX_TAMANO_LOTE = int(os.getenv("OUTBOX_TAMANO_LOTE", "1"))
+OUTBOX_MAX_INTENTOS = int(os.getenv("OUTBOX_MAX_INTENTOS", "12"))
+OUTBOX_BACKOFF_BASE = float(os.getenv("OUTBOX_BACKOFF_BASE", "1"))
+OUTBOX_BACKOFF_MAX = float(os.getenv("OUTBOX_BACKOFF_MAX", "300"))
+# Tiempo que un worker tiene reservadas las filas que está enviando; si no
+# confirma ni reintenta antes (p. ej. se cayó), otro worker las toma
+OUTBOX_RESERVA_SEGUNDOS = float(os.getenv("OUTBOX_RESERVA_SEGUNDOS", "60"))
+# Las fallidas se guardan (sin token) este tiempo para revisarlas y luego se borran
+OUTBOX_RETENCION_FALLIDOS = float(os.getenv("OUTBOX_RETENCION_FALLIDOS", str(7 * 86400)))
+
+# Cliente HTTP compartido: reutiliza conexiones TCP/TLS entre peticiones
+http_client: httpx.AsyncClient | None = None
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global http_client, cache, outbox, indice_categorias
+    cache = crear_cache()
+    indice_categorias = crear_indice_categorias()
+    outbox = Outbox(OUTBOX_RUTA)
+    http_client = httpx.AsyncClient(
+        timeout=10,
+        limits=httpx.Limits(max_connections=100, max_keepalive_connections=20)
+    )
+    tarea_outbox = asyncio.create_task(despachar_outbox())
+    tarea_indice = asyncio.create_task(indice_categorias.escribir_pendientes())
+    tarea_cache = asyncio.create_task(cache.escribir_pendientes())
+    try:
+        yield
+    finally:
+        for tarea in (tarea_outbox, tarea_indice, tarea_cache):
+            tarea.cancel()
+            try:
+                await tarea
+            except asyncio.CancelledError:
+                pass
+        outbox.cerrar()
+        outbox = None
+        await http_client.aclose()
+        http_client = None
+        if client:
+            await client.close()
+        cache.cerrar()
+        cache = CacheResultados(CACHE_MAX_ENTRADAS, CACHE_TTL_SEGUNDOS)
+        indice_categorias.cerrar()
+        indice_categorias = IndiceCategorias(":memory:")
+
+
+app = FastAPI(title="IA Financiera - Groq Edition", lifespan=lifespan)
 
 
 # ==============================
@@ -46,6 +259,11 @@ app = FastAPI(title="IA Financiera - Groq Edition")
 class MensajeUsuario(BaseModel):
     mensaje: str
 
+class FilaImportacion(MensajeUsuario):
+    """Línea NDJSON de una importación; monto y fecha como en las columnas CSV."""
+    monto: float | str | None = None
+    fecha: str | None = None
+
 class ClasificacionRespuesta(BaseModel):
     type: str
     amount: float
@@ -53,11 +271,38 @@ class ClasificacionRespuesta(BaseModel):
     descripcion: str
     date: str
     advertencia: str | None = None
+    degradado: bool = False
+
+class AnalisisFusionado(BaseModel):
+    """
+    Esquema estricto de la respuesta del modo fusionado. La categoría se
+    valida ya sin espacios a los lados: una de puros espacios es inválida.
+    """
+    model_config = ConfigDict(extra="forbid", strict=True, str_strip_whitespace=True)
+
+    ofensivo: bool
+    doble_sentido: bool
+    type: Literal["income", "expense"]
+    categoria: str = Field(min_length=1, max_length=40)
+
+class AnalisisLoteItem(AnalisisFusionado):
+    """Un elemento de la respuesta de la clasificación en lote."""
+    id: int
+
+class ResultadoLote(BaseModel):
+    indice: int
+    resultado: ClasificacionRespuesta | None = None
+    error: str | None = None
 
 
 # ==============================
 # UTILIDADES
 # ==============================
+# Empieza con una cifra: "Hola, pagué 50" no debe tomar la coma como monto
+PATRON_MONTO = re.compile(r"\$?\s*(\d[\d.,]*)")
+PATRON_PUNTUACION = re.compile(r"[^\w#]+")
+
+
 def eliminar_acentos(texto: str) -> str:
     return "".join(
         c for c in unicodedata.normalize("NFD", texto)
@@ -65,12 +310,1333 @@ def eliminar_acentos(texto: str) -> str:
     )
 
 
+def normalizar_mensaje(texto: str) -> str:
+    """
+    Forma canónica del mensaje para la caché: sin acentos, en minúsculas,
+    con el monto enmascarado, sin puntuación y los espacios colapsados. Así
+    "Pagué $50 de Uber." y "pague 80 de uber" comparten entrada.
+    """
+    texto = eliminar_acentos(texto).casefold()
+    texto = PATRON_MONTO.sub(" # ", texto)
+    texto = PATRON_PUNTUACION.sub(" ", texto)
+    return " ".join(texto.split())
+
+
 # =====================================================
-# 🔥 DETECCIÓN DE GROCERÍAS / CONTENIDO OFENSIVO (IA)
+# 🔥 MÉTRICAS
+# =====================================================
+CUBETAS_LATENCIA = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+DESCRIPCION_METRICAS = {
+    "ia_etapa_duracion_segundos": ("histogram", "Latencia de cada etapa de la clasificación"),
+    "ia_etapa_errores_total": ("counter", "Etapas que terminaron con excepción (sin contar rechazos 4xx)"),
+    "ia_etapa_rechazos_total": ("counter", "Etapas que rechazaron la entrada del usuario (HTTP 4xx)"),
+    "ia_respaldos_total": ("counter", "Campos resueltos con el respaldo local porque Groq falló"),
+    "groq_llamada_duracion_segundos": ("histogram", "Latencia de la llamada HTTP a Groq"),
+    "groq_tokens_total": ("counter", "Tokens consumidos según el campo usage de Groq"),
+    "groq_costo_total": ("counter", "Costo estimado en USD de los tokens consumidos (GROQ_PRECIO_*)"),
+}
+
+
+class Metricas:
+    """Contadores e histogramas en memoria, exportados en formato Prometheus."""
+
+    def __init__(self):
+        self.contadores: dict[tuple, float] = defaultdict(float)
+        # clave → [una cuenta por cubeta..., +Inf, suma]
+        self.histogramas: dict[tuple, list] = {}
+
+    def contar(self, nombre: str, valor: float = 1, **etiquetas):
+        self.contadores[(nombre, tuple(sorted(etiquetas.items())))] += valor
+
+    def observar(self, nombre: str, valor: float, **etiquetas):
+        clave = (nombre, tuple(sorted(etiquetas.items())))
+        histograma = self.histogramas.get(clave)
+        if histograma is None:
+            histograma = self.histogramas[clave] = [0] * (len(CUBETAS_LATENCIA) + 1) + [0.0]
+
+        histograma[bisect_left(CUBETAS_LATENCIA, valor)] += 1
+        histograma[-1] += valor
+
+    @contextmanager
+    def medir(self, etapa: str, nombre: str = "ia_etapa_duracion_segundos", contar_errores: bool = True):
+        """
+        contar_errores=False cuando una medición externa de la misma etapa ya
+        los cuenta. Un HTTPException 4xx es entrada inválida del usuario (sin
+        monto, ofensivo...), no una falla: se cuenta aparte para no disparar alertas.
+        """
+        inicio = time.perf_counter()
+        try:
+            yield
+        except HTTPException as e:
+            if contar_errores:
+                if e.status_code < 500:
+                    self.contar("ia_etapa_rechazos_total", etapa=etapa, codigo=str(e.status_code))
+                else:
+                    self.contar("ia_etapa_errores_total", etapa=etapa)
+            raise
+        except Exception:
+            if contar_errores:
+                self.contar("ia_etapa_errores_total", etapa=etapa)
+            raise
+        finally:
+            self.observar(nombre, time.perf_counter() - inicio, etapa=etapa)
+
+    def exportar(self, extras: list[tuple[str, str, str, dict, float]]) -> str:
+        """extras: métricas calculadas al momento (nombre, tipo, ayuda, etiquetas, valor)."""
+
+        lineas = []
+        vistos = set()
+
+        def encabezado(nombre: str, tipo: str, ayuda: str):
+            if nombre not in vistos:
+                vistos.add(nombre)
+                lineas.append(f"# HELP {nombre} {ayuda}")
+                lineas.append(f"# TYPE {nombre} {tipo}")
+
+        for (nombre, etiquetas), valor in sorted(self.contadores.items()):
+            encabezado(nombre, *DESCRIPCION_METRICAS.get(nombre, ("counter", nombre)))
+            lineas.append(f"{nombre}{formatear_etiquetas(dict(etiquetas))} {valor:.15g}")
+
+        for (nombre, etiquetas), histograma in sorted(self.histogramas.items()):
+            encabezado(nombre, *DESCRIPCION_METRICAS.get(nombre, ("histogram", nombre)))
+            acumulado = 0
+            for limite, cuenta in zip((*CUBETAS_LATENCIA, "+Inf"), histograma[:-1]):
+                acumulado += cuenta
+                lineas.append(f"{nombre}_bucket{formatear_etiquetas({**dict(etiquetas), 'le': limite})} {acumulado}")
+            lineas.append(f"{nombre}_sum{formatear_etiquetas(dict(etiquetas))} {histograma[-1]:.6f}")
+            lineas.append(f"{nombre}_count{formatear_etiquetas(dict(etiquetas))} {acumulado}")
+
+        for nombre, tipo, ayuda, etiquetas, valor in extras:
+            encabezado(nombre, tipo, ayuda)
+            lineas.append(f"{nombre}{formatear_etiquetas(etiquetas)} {valor:.15g}")
+
+        return "\n".join(lineas) + "\n"
+
+
+def formatear_etiquetas(etiquetas: dict) -> str:
+    if not etiquetas:
+        return ""
+
+    def escapar(valor) -> str:
+        return str(valor).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+    return "{" + ",".join(f'{k}="{escapar(v)}"' for k, v in etiquetas.items()) + "}"
+
+
+metricas = Metricas()
+
+
+# =====================================================
+# 🔥 ARCHIVOS SQLITE COMPARTIDOS
+# =====================================================
+def abrir_sqlite(ruta: str, synchronous: str = "NORMAL") -> sqlite3.Connection:
+    """
+    Conexión en modo WAL (varios workers comparten el archivo) que se puede
+    usar desde los hilos de asyncio.to_thread; quien la usa la protege con un lock.
+    """
+    conn = sqlite3.connect(ruta, timeout=5, check_same_thread=False, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute(f"PRAGMA synchronous={synchronous}")
+    return conn
+
+
+@contextmanager
+def transaccion(conn: sqlite3.Connection):
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        yield
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+
+
+class EscritorSQLite(ABC):
+    """
+    Base de lo que se guarda en SQLite sin tocarlo desde el event loop: lo
+    nuevo se acumula en memoria y la tarea escribir_pendientes lo vuelca en
+    bloque desde un hilo. La subclase decide qué forma un bloque
+    (_tomar_pendientes) y cómo se escribe (_escribir_bloque).
+    """
+
+    # Para los logs: "⚠ Error escribiendo {descripcion}"
+    descripcion = "SQLite"
+
+    def __init__(self, ruta: str):
+        self._lock = threading.Lock()
+        self._conn = abrir_sqlite(ruta)
+        self.hay_pendientes = asyncio.Event()
+        self.descartadas = 0
+        # Bloques tomados por escribir_pendientes y, de ellos, los ya escritos
+        self._bloques_tomados = 0
+        self._bloques_escritos = 0
+
+    @abstractmethod
+    def _tomar_pendientes(self):
+        """Saca lo acumulado desde el último bloque y lo devuelve."""
+
+    @abstractmethod
+    def _escribir_bloque(self, bloque):
+        """Escribe un bloque en una transacción; corre fuera del event loop."""
+
+    def _bloque_terminado(self):
+        """Se llama al terminar la escritura de un bloque, haya salido bien o no."""
+
+    def _antes_de_cerrar(self):
+        """Último uso de la conexión, con el lock tomado."""
+
+    async def escribir_pendientes(self):
+        """Tarea de fondo: vuelca en SQLite, en una transacción, lo acumulado desde la última vez."""
+
+        while True:
+            try:
+                await self.hay_pendientes.wait()
+                self.hay_pendientes.clear()
+                bloque = self._tomar_pendientes()
+                self._bloques_tomados += 1
+                numero = self._bloques_tomados
+                try:
+                    await asyncio.to_thread(self._escribir_bloque, bloque)
+                    self._bloques_escritos = numero
+                finally:
+                    self._bloque_terminado()
+
+            except asyncio.CancelledError:
+                raise
+
+            except Exception as e:
+                log.error("⚠ Error escribiendo %s: %s", self.descripcion, e)
+                await asyncio.sleep(1)
+
+    def cerrar(self):
+        """Escribe lo pendiente y cierra; se llama ya detenida escribir_pendientes."""
+        try:
+            self._escribir_bloque(self._tomar_pendientes())
+        except Exception as e:
+            log.error("⚠ No se pudo escribir lo pendiente de %s: %s", self.descripcion, e)
+        with self._lock:
+            self._antes_de_cerrar()
+            self._conn.close()
+
+
+# =====================================================
+# 🔥 CACHÉ DE RESULTADOS
+# =====================================================
+class CacheResultados:
+    """
+    Interfaz común de los backends de caché, con contadores de aciertos.
+    obtener es asíncrono para que un backend con disco lea fuera del event
+    loop; guardar nunca bloquea (ese backend deja la escritura en cola).
+    """
+
+    nombre = "ninguno"
+
+    def __init__(self, max_entradas: int, ttl: float):
+        self.max_entradas = max_entradas
+        self.ttl = ttl
+        self.aciertos = 0
+        self.fallos = 0
+
+    async def obtener(self, clave: str) -> dict | None:
+        valor = await self._consultar(clave)
+        if valor is None:
+            self.fallos += 1
+        else:
+            self.aciertos += 1
+        return valor
+
+    def guardar(self, clave: str, valor: dict):
+        self._escribir(clave, valor)
+
+    def estadisticas(self) -> dict:
+        consultas = self.aciertos + self.fallos
+        return {
+            "backend": self.nombre,
+            "entradas": self._tamano(),
+            "max_entradas": self.max_entradas,
+            "ttl_segundos": self.ttl,
+            "aciertos": self.aciertos,
+            "fallos": self.fallos,
+            "tasa_aciertos": round(self.aciertos / consultas, 4) if consultas else 0.0
+        }
+
+    async def escribir_pendientes(self):
+        """Tarea de fondo de los backends que escriben en bloque; aquí no hay nada que hacer."""
+
+    async def _consultar(self, clave: str) -> dict | None:
+        return self._leer(clave)
+
+    def _leer(self, clave: str) -> dict | None:
+        return None
+
+    def _escribir(self, clave: str, valor: dict):
+        pass
+
+    def _tamano(self) -> int:
+        return 0
+
+    def cerrar(self):
+        pass
+
+
+class CacheMemoria(CacheResultados):
+    """LRU con TTL dentro del proceso."""
+
+    nombre = "memoria"
+
+    def __init__(self, max_entradas: int, ttl: float):
+        super().__init__(max_entradas, ttl)
+        self._datos: OrderedDict[str, tuple[float, dict]] = OrderedDict()
+
+    def _leer(self, clave: str) -> dict | None:
+        entrada = self._datos.get(clave)
+        if entrada is None:
+            return None
+
+        expira, valor = entrada
+        if expira < time.monotonic():
+            del self._datos[clave]
+            return None
+
+        self._datos.move_to_end(clave)
+        return valor
+
+    def _escribir(self, clave: str, valor: dict):
+        self._datos[clave] = (time.monotonic() + self.ttl, valor)
+        self._datos.move_to_end(clave)
+
+        while len(self._datos) > self.max_entradas:
+            self._datos.popitem(last=False)
+
+    def _tamano(self) -> int:
+        return len(self._datos)
+
+
+class CacheSQLite(EscritorSQLite, CacheResultados):
+    """
+    Caché en un archivo SQLite local (modo WAL), compartida por todos los
+    workers de uvicorn de la misma máquina.
+
+    Las lecturas van por asyncio.to_thread y las escrituras las vuelca en
+    bloque escribir_pendientes (mientras tanto se leen de la cola).
+    """
+
+    nombre = "sqlite"
+    descripcion = "la caché SQLite"
+
+    # Cada cuántas escrituras se purgan expiradas y se recorta al máximo
+    PURGA_CADA = 100
+
+    def __init__(self, max_entradas: int, ttl: float, ruta: str):
+        CacheResultados.__init__(self, max_entradas, ttl)
+        EscritorSQLite.__init__(self, ruta)
+        self._escrituras = 0
+        # clave → (valor, guardado); se vacía en cada bloque de escritura
+        self._pendientes: dict[str, tuple[dict, float]] = {}
+        self._escribiendo: dict[str, tuple[dict, float]] = {}
+        # clave → último acierto; se escribe en bloque, no en cada lectura
+        self._usados: dict[str, float] = {}
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS cache ("
+            " clave TEXT PRIMARY KEY, valor TEXT NOT NULL,"
+            " expira REAL NOT NULL, usado REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS cache_usado ON cache(usado)")
+
+    async def _consultar(self, clave: str) -> dict | None:
+        pendiente = self._pendientes.get(clave) or self._escribiendo.get(clave)
+        if pendiente is not None:
+            return pendiente[0]
+        return await asyncio.to_thread(self._leer, clave)
+
+    def _leer(self, clave: str) -> dict | None:
+        ahora = time.time()
+        with self._lock:
+            fila = self._conn.execute(
+                "SELECT valor, expira FROM cache WHERE clave = ?", (clave,)
+            ).fetchone()
+            if fila is None:
+                return None
+
+            if fila[1] < ahora:
+                self._conn.execute("DELETE FROM cache WHERE clave = ?", (clave,))
+                return None
+
+            # Un acierto sólo toca memoria; la recencia llega al archivo cada PURGA_CADA
+            self._usados[clave] = ahora
+            if len(self._usados) >= self.PURGA_CADA:
+                self._guardar_usados()
+
+        return json.loads(fila[0])
+
+    def _guardar_usados(self):
+        """Vuelca la recencia acumulada en una sola transacción (con el lock tomado)."""
+        if not self._usados:
+            return
+
+        try:
+            with transaccion(self._conn):
+                self._conn.executemany(
+                    "UPDATE cache SET usado = ? WHERE clave = ?",
+                    [(usado, clave) for clave, usado in self._usados.items()]
+                )
+        finally:
+            self._usados.clear()
+
+    def _escribir(self, clave: str, valor: dict):
+        if len(self._pendientes) >= self.max_entradas and clave not in self._pendientes:
+            # El archivo no da abasto: esta entrada sólo se pierde de la caché
+            self.descartadas += 1
+            return
+
+        self._pendientes[clave] = (valor, time.time())
+        self.hay_pendientes.set()
+
+    def _tomar_pendientes(self) -> dict[str, tuple[dict, float]]:
+        # El bloque sigue respondiendo lecturas hasta que está en disco
+        self._escribiendo, self._pendientes = self._pendientes, {}
+        return self._escribiendo
+
+    def _bloque_terminado(self):
+        self._escribiendo = {}
+
+    def _escribir_bloque(self, entradas: dict[str, tuple[dict, float]]):
+        if not entradas:
+            return
+
+        filas = [
+            (clave, json.dumps(valor), guardado + self.ttl, guardado)
+            for clave, (valor, guardado) in entradas.items()
+        ]
+        ahora = time.time()
+        with self._lock:
+            with transaccion(self._conn):
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO cache (clave, valor, expira, usado) VALUES (?, ?, ?, ?)",
+                    filas
+                )
+
+            antes, self._escrituras = self._escrituras, self._escrituras + len(filas)
+            if antes // self.PURGA_CADA != self._escrituras // self.PURGA_CADA:
+                self._guardar_usados()
+                self._conn.execute("DELETE FROM cache WHERE expira < ?", (ahora,))
+                self._conn.execute(
+                    "DELETE FROM cache WHERE clave IN ("
+                    " SELECT clave FROM cache ORDER BY usado DESC LIMIT -1 OFFSET ?)",
+                    (self.max_entradas,)
+                )
+
+    def _tamano(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+
+    def estadisticas(self) -> dict:
+        return {**super().estadisticas(), "escrituras_pendientes": len(self._pendientes), "escrituras_descartadas": self.descartadas}
+
+    def _antes_de_cerrar(self):
+        self._guardar_usados()
+
+
+def crear_cache() -> CacheResultados:
+    try:
+        if CACHE_BACKEND == "memoria":
+            return CacheMemoria(CACHE_MAX_ENTRADAS, CACHE_TTL_SEGUNDOS)
+        if CACHE_BACKEND == "sqlite":
+            return CacheSQLite(CACHE_MAX_ENTRADAS, CACHE_TTL_SEGUNDOS, CACHE_SQLITE_RUTA)
+        if CACHE_BACKEND != "ninguno":
+            log.warning("⚠ CACHE_BACKEND desconocido, caché desactivada: %s", CACHE_BACKEND)
+
+    except Exception as e:
+        log.error("❌ No se pudo inicializar la caché: %s", e)
+
+    return CacheResultados(CACHE_MAX_ENTRADAS, CACHE_TTL_SEGUNDOS)
+
+
+# Se reemplaza por el backend configurado al arrancar la app (lifespan)
+cache = CacheResultados(CACHE_MAX_ENTRADAS, CACHE_TTL_SEGUNDOS)
+
+
+# =====================================================
+# 🔥 CLASIFICADOR LOCAL (LÉXICO Y REGLAS)
+# =====================================================
+# Todas las entradas van sin acentos y en minúsculas, como normalizar_mensaje.
+GROSERIAS = [
+    r"put[oa]s?", r"putazos?", r"hijueputa", r"hdp", r"pendej\w*", r"ching\w*",
+    r"cabron\w*", r"vergas?", r"vergazos?", r"culer[oa]s?", r"culos?", r"mierdas?",
+    r"pinches?", r"jotos?", r"maric[oa]s?", r"maricon\w*", r"carajo", r"mamon\w*",
+    r"mamadas?", r"ojetes?", r"zorras?", r"idiotas?", r"imbeciles?", r"estupid[oa]s?",
+    r"panochas?", r"coger", r"cogi\w*", r"malparid[oa]s?"
+]
+
+# Palabras frecuentes en albures: no prueban doble sentido, pero impiden
+# que el nivel local lo descarte
+DISPARADORES_DOBLE_SENTIDO = [
+    "albur", "chile", "chiles", "huevo", "huevos", "nalga", "nalgas", "pajaro",
+    "camote", "pepino", "platano", "chorizo", "salchicha", "leche", "aguacates",
+    "mamey", "pelos", "hoyo"
+]
+
+PALABRAS_INGRESO = [
+    "me pagaron", "me depositaron", "me transfirieron", "me dieron", "me devolvieron",
+    "me regalaron", "cobre", "recibi", "gane", "vendi", "quincena", "sueldo",
+    "salario", "nomina", "aguinaldo", "deposito", "reembolso", "ingreso", "bono",
+    "utilidades", "intereses"
+]
+
+PALABRAS_GASTO = [
+    "pague", "compre", "gaste", "gasto", "pago", "pagar", "compra", "transferi",
+    "deposite", "me cobraron", "cargo", "propina", "invite", "renta", "colegiatura",
+    "suscripcion", "mensualidad", "recargue"
+]
+
+# palabra o comercio → (categoría, tipo implícito)
+CATEGORIAS_LOCALES = {
+    "uber": ("Transporte", "expense"), "didi": ("Transporte", "expense"),
+    "cabify": ("Transporte", "expense"), "taxi": ("Transporte", "expense"),
+    "metro": ("Transporte", "expense"), "metrobus": ("Transporte", "expense"),
+    "camion": ("Transporte", "expense"), "autobus": ("Transporte", "expense"),
+    "pasaje": ("Transporte", "expense"), "caseta": ("Transporte", "expense"),
+    "gasolina": ("Gasolina", "expense"), "gasolinera": ("Gasolina", "expense"),
+    "pemex": ("Gasolina", "expense"),
+    "uber eats": ("Comida", "expense"), "didi food": ("Comida", "expense"),
+    "rappi": ("Comida", "expense"), "comida": ("Comida", "expense"),
+    "tacos": ("Comida", "expense"), "restaurante": ("Comida", "expense"),
+    "pizza": ("Comida", "expense"), "hamburguesa": ("Comida", "expense"),
+    "desayuno": ("Comida", "expense"), "almuerzo": ("Comida", "expense"),
+    "cena": ("Comida", "expense"), "starbucks": ("Cafe", "expense"),
+    "cafe": ("Cafe", "expense"),
+    "walmart": ("Supermercado", "expense"), "soriana": ("Supermercado", "expense"),
+    "chedraui": ("Supermercado", "expense"), "costco": ("Supermercado", "expense"),
+    "bodega aurrera": ("Supermercado", "expense"), "aurrera": ("Supermercado", "expense"),
+    "la comer": ("Supermercado", "expense"), "superama": ("Supermercado", "expense"),
+    "supermercado": ("Supermercado", "expense"), "despensa": ("Supermercado", "expense"),
+    "mandado": ("Supermercado", "expense"), "oxxo": ("Tienda", "expense"),
+    "netflix": ("Streaming", "expense"), "spotify": ("Streaming", "expense"),
+    "disney": ("Streaming", "expense"), "hbo": ("Streaming", "expense"),
+    "prime video": ("Streaming", "expense"),
+    "cfe": ("Luz", "expense"), "luz": ("Luz", "expense"),
+    "agua": ("Agua", "expense"),
+    "telmex": ("Internet", "expense"), "izzi": ("Internet", "expense"),
+    "totalplay": ("Internet", "expense"), "megacable": ("Internet", "expense"),
+    "internet": ("Internet", "expense"),
+    "telcel": ("Celular", "expense"), "movistar": ("Celular", "expense"),
+    "recarga": ("Celular", "expense"),
+    "renta": ("Renta", "expense"), "alquiler": ("Renta", "expense"),
+    "farmacia": ("Farmacia", "expense"), "medicinas": ("Farmacia", "expense"),
+    "doctor": ("Salud", "expense"), "medico": ("Salud", "expense"),
+    "dentista": ("Salud", "expense"), "hospital": ("Salud", "expense"),
+    "gimnasio": ("Gimnasio", "expense"), "gym": ("Gimnasio", "expense"),
+    "smartfit": ("Gimnasio", "expense"),
+    "colegiatura": ("Educacion", "expense"), "escuela": ("Educacion", "expense"),
+    "universidad": ("Educacion", "expense"), "curso": ("Educacion", "expense"),
+    "ropa": ("Ropa", "expense"), "zapatos": ("Ropa", "expense"),
+    "cine": ("Entretenimiento", "expense"), "cinepolis": ("Entretenimiento", "expense"),
+    "cinemex": ("Entretenimiento", "expense"), "concierto": ("Entretenimiento", "expense"),
+    "amazon": ("Compras", "expense"), "mercado libre": ("Compras", "expense"),
+    "quincena": ("Salario", "income"), "sueldo": ("Salario", "income"),
+    "salario": ("Salario", "income"), "nomina": ("Salario", "income"),
+    "aguinaldo": ("Aguinaldo", "income"), "reembolso": ("Reembolso", "income"),
+    "vendi": ("Ventas", "income"), "bono": ("Bono", "income"),
+    "intereses": ("Intereses", "income")
+}
+
+
+def compilar_lexico(palabras, escapar=True) -> re.Pattern:
+    # Las alternativas más largas primero: "uber eats" gana a "uber"
+    alternativas = sorted(palabras, key=len, reverse=True)
+    if escapar:
+        alternativas = [re.escape(p) for p in alternativas]
+    return re.compile(r"\b(?:" + "|".join(alternativas) + r")\b")
+
+
+PATRON_GROSERIAS = compilar_lexico(GROSERIAS, escapar=False)
+PATRON_DOBLE_SENTIDO = compilar_lexico(DISPARADORES_DOBLE_SENTIDO)
+PATRON_INGRESO = compilar_lexico(PALABRAS_INGRESO)
+PATRON_GASTO = compilar_lexico(PALABRAS_GASTO)
+PATRON_CATEGORIAS = compilar_lexico(CATEGORIAS_LOCALES)
+
+# Cuántos análisis resolvió cada nivel de la cascada
+# ("respaldo": Groq no respondió y se usó el clasificador local)
+niveles_resueltos = {"local": 0, "cache": 0, "groq": 0, "respaldo": 0}
+
+
+def detectar_groserias_local(normalizado: str) -> tuple[bool, float]:
+    """
+    Una grosería de la lista basta para marcarlo ofensivo. No encontrar
+    ninguna sólo da confianza si los léxicos explican todo el mensaje (montos,
+    comercios, verbos de ingreso/gasto y palabras vacías); lo demás lo revisa
+    Groq, que conoce insultos que la lista no tiene.
+    """
+    if PATRON_GROSERIAS.search(normalizado):
+        return True, 1.0
+
+    resto = normalizado
+    for patron in (PATRON_CATEGORIAS, PATRON_INGRESO, PATRON_GASTO):
+        resto = patron.sub(" ", resto)
+    if any(p not in PALABRAS_VACIAS for p in PATRON_TERMINO.findall(resto)):
+        return False, CONFIANZA_LOCAL_NO_OFENSIVO
+    return False, 0.9
+
+
+def clasificador_local(
+    mensaje: str, categoria_usuario: tuple[str, str | None] | None = None, tipo: str | None = None
+) -> tuple[dict, float]:
+    """
+    Primer nivel de la cascada: reglas y léxicos en proceso, sin red.
+    Devuelve el análisis y su confianza (la menor de los cuatro campos).
+    categoria_usuario es lo que el índice del usuario sabe del mensaje;
+    tipo, el que ya se conoce por otra vía (el signo del monto importado).
+    """
+    normalizado = normalizar_mensaje(mensaje)
+
+    ofensivo, conf_ofensivo = detectar_groserias_local(normalizado)
+    if ofensivo:
+        return {"ofensivo": True, "doble_sentido": False, "type": None, "categoria": None, "degradado": False}, conf_ofensivo
+
+    # Doble sentido: sin disparadores se descarta; con ellos no se sabe
+    conf_doble = 0.0 if PATRON_DOBLE_SENTIDO.search(normalizado) else 0.9
+
+    # Categoría: la que el usuario ya usa para ese comercio, o la del léxico general
+    categoria, tipo_implicito, conf_categoria = None, None, 0.0
+    match = PATRON_CATEGORIAS.search(normalizado)
+    if categoria_usuario:
+        (categoria, tipo_implicito), conf_categoria = categoria_usuario, 0.95
+    elif match:
+        categoria, tipo_implicito = CATEGORIAS_LOCALES[match.group(0)]
+        conf_categoria = 0.9
+
+    # Tipo por palabras de ingreso/gasto; si no hay, el implícito de la categoría
+    es_ingreso = PATRON_INGRESO.search(normalizado) is not None
+    es_gasto = PATRON_GASTO.search(normalizado) is not None
+
+    if tipo:
+        conf_tipo = 1.0
+    elif es_ingreso != es_gasto:
+        tipo, conf_tipo = ("income" if es_ingreso else "expense"), 0.95
+    elif not es_ingreso and tipo_implicito:
+        tipo, conf_tipo = tipo_implicito, 0.85
+    else:
+        tipo, conf_tipo = "expense", 0.0
+
+    analisis = {"ofensivo": False, "doble_sentido": False, "type": tipo, "categoria": categoria, "degradado": False}
+    return analisis, min(conf_ofensivo, conf_doble, conf_tipo, conf_categoria)
+
+
+# =====================================================
+# 🔥 ÍNDICE DE CATEGORÍAS POR USUARIO
+# =====================================================
+# Palabras que no dicen nada del comercio ni de la categoría
+PALABRAS_VACIAS = {
+    "del", "las", "los", "con", "para", "por", "que", "mis", "una", "uno", "sus",
+    "pesos", "peso", "mxn", "hoy", "ayer", "fui", "fue", "mas", "muy", "este",
+    "esta", "ese", "esa", "mes", "dia", "semana", "pague", "pago", "pagar",
+    "compre", "compra", "gaste", "gasto", "transferi", "deposite", "cobraron",
+    "cobro", "cobre", "recibi", "gane", "invite", "recargue", "pagaron",
+    "depositaron", "transfirieron", "dieron", "devolvieron", "regalaron"
+}
+
+PATRON_TERMINO = re.compile(r"[a-z][a-z0-9]{2,}")
+
+
+def extraer_terminos(normalizado: str) -> list[str]:
+    """Pares de palabras seguidas (más específicos) y luego palabras sueltas."""
+    palabras = [p for p in PATRON_TERMINO.findall(normalizado) if p not in PALABRAS_VACIAS]
+    pares = [f"{a} {b}" for a, b in zip(palabras, palabras[1:])]
+    return pares + palabras
+
+
+def trigramas(texto: str) -> frozenset[str]:
+    relleno = f"  {texto} "
+    return frozenset(relleno[i:i + 3] for i in range(len(relleno) - 2))
+
+
+def usuario_de_token(token: str) -> str:
+    """
+    Clave del usuario para el índice: hash de la credencial completa. No se
+    usa el "sub" de un JWT porque aquí no se verifica la firma y cualquiera
+    podría escribir en el índice de otro.
+
+    Por eso el índice es por token, no por persona: al renovar el token se
+    empieza vacío y lo del token viejo se borra tras INDICE_TTL_SEGUNDOS sin
+    uso. Con tokens de larga vida (los de la app) equivale a por usuario.
+    """
+    credencial = token.removeprefix("Bearer ").strip()
+    return hashlib.sha256(credencial.encode()).hexdigest()[:32]
+
+
+class VocabularioTrigramas:
+    """Búsqueda aproximada de términos por trigramas compartidos."""
+
+    def __init__(self):
+        self._por_trigrama: dict[str, set[str]] = defaultdict(set)
+        self._trigramas: dict[str, frozenset[str]] = {}
+
+    def agregar(self, termino: str):
+        if termino in self._trigramas:
+            return
+        self._trigramas[termino] = trigramas(termino)
+        for t in self._trigramas[termino]:
+            self._por_trigrama[t].add(termino)
+
+    def quitar(self, termino: str):
+        for t in self._trigramas.pop(termino, ()):
+            self._por_trigrama[t].discard(termino)
+            if not self._por_trigrama[t]:
+                del self._por_trigrama[t]
+
+    def buscar(self, termino: str, umbral: float) -> tuple[str, float] | None:
+        buscados = trigramas(termino)
+        compartidos: dict[str, int] = defaultdict(int)
+        for t in buscados:
+            for candidato in self._por_trigrama.get(t, ()):
+                compartidos[candidato] += 1
+
+        mejor = None
+        for candidato, n in compartidos.items():
+            similitud = n / (len(buscados) + len(self._trigramas[candidato]) - n)
+            if similitud >= umbral and (mejor is None or similitud > mejor[1]):
+                mejor = (candidato, similitud)
+        return mejor
+
+
+class IndiceUsuario:
+    """Lo aprendido de un usuario. Los OrderedDict van del menos al más usado."""
+
+    def __init__(self, usuario: str):
+        self.usuario = usuario
+        self.cargado = time.monotonic()
+        # Bloque de escritura que debe terminar para que lo aprendido esté en disco
+        self.escribir_en = 0
+        # término → {categoría: votos}
+        self.terminos: OrderedDict[str, dict[str, int]] = OrderedDict()
+        # categoría → {"income"/"expense": votos}
+        self.categorias: OrderedDict[str, dict[str, int]] = OrderedDict()
+        # categoría sin acentos y en minúsculas → como se guardó
+        self.canonicas: dict[str, str] = {}
+        self.vocabulario_terminos = VocabularioTrigramas()
+        self.vocabulario_categorias = VocabularioTrigramas()
+
+    def votar_termino(self, termino: str, categoria: str, n: int = 1):
+        votos = self.terminos.get(termino)
+        if votos is None:
+            votos = self.terminos[termino] = {}
+            if " " not in termino:
+                self.vocabulario_terminos.agregar(termino)
+        votos[categoria] = votos.get(categoria, 0) + n
+        self.terminos.move_to_end(termino)
+
+    def votar_categoria(self, categoria: str, tipo: str | None, n: int = 1):
+        votos = self.categorias.get(categoria)
+        if votos is None:
+            votos = self.categorias[categoria] = {}
+            clave = eliminar_acentos(categoria).casefold()
+            self.canonicas[clave] = categoria
+            self.vocabulario_categorias.agregar(clave)
+        if tipo:
+            votos[tipo] = votos.get(tipo, 0) + n
+        self.categorias.move_to_end(categoria)
+
+    def olvidar_termino(self, termino: str):
+        del self.terminos[termino]
+        self.vocabulario_terminos.quitar(termino)
+
+    def olvidar_categoria(self, categoria: str):
+        del self.categorias[categoria]
+        clave = eliminar_acentos(categoria).casefold()
+        del self.canonicas[clave]
+        self.vocabulario_categorias.quitar(clave)
+
+        for termino in [t for t, votos in self.terminos.items() if categoria in votos]:
+            del self.terminos[termino][categoria]
+            if not self.terminos[termino]:
+                self.olvidar_termino(termino)
+
+    def canonica(self, categoria: str) -> str | None:
+        """La categoría existente igual o parecida a la dada, si la hay."""
+        clave = eliminar_acentos(categoria).casefold()
+        if clave in self.canonicas:
+            return self.canonicas[clave]
+
+        parecida = self.vocabulario_categorias.buscar(clave, INDICE_SIMILITUD_CATEGORIA)
+        return self.canonicas[parecida[0]] if parecida else None
+
+    def categoria_de(self, termino: str) -> str | None:
+        """Categoría dominante del término (o de uno muy parecido), si es confiable."""
+        votos = self.terminos.get(termino)
+        if votos is None and " " not in termino and len(termino) >= 5:
+            parecido = self.vocabulario_terminos.buscar(termino, INDICE_SIMILITUD_TERMINO)
+            if parecido:
+                votos = self.terminos[parecido[0]]
+        if not votos:
+            return None
+
+        categoria, n = max(votos.items(), key=lambda kv: kv[1])
+        if n >= INDICE_VOTOS_MINIMOS and n / sum(votos.values()) >= INDICE_PROPORCION_MINIMA:
+            return categoria
+        return None
+
+    def principales(self, n: int) -> list[str]:
+        """Las n categorías con más votos; a igual número, las usadas más recientemente."""
+        if n <= 0:
+            return []
+        recientes = list(reversed(self.categorias))
+        return sorted(recientes, key=lambda c: sum(self.categorias[c].values()), reverse=True)[:n]
+
+    def tipo_de(self, categoria: str) -> str | None:
+        votos = self.categorias.get(categoria)
+        if not votos:
+            return None
+        tipo, n = max(votos.items(), key=lambda kv: kv[1])
+        return tipo if n / sum(votos.values()) >= INDICE_PROPORCION_MINIMA else None
+
+
+class IndiceCategorias(EscritorSQLite):
+    """
+    Índice incremental por usuario (comercio/palabra → categoría) sobre
+    SQLite en modo WAL. Cada worker guarda en memoria los usuarios que
+    usó hace poco; lo que aprende se escribe como incrementos, así varios
+    workers pueden compartir el archivo. Lo que aprende un worker lo ven
+    los demás al releer al usuario (cada INDICE_RECARGA_SEGUNDOS).
+
+    Búsquedas y aprendizaje sólo tocan memoria. La carga de un usuario va
+    por asyncio.to_thread y lo aprendido lo escribe escribir_pendientes.
+    """
+
+    descripcion = "el índice de categorías"
+
+    # Cada cuántas escrituras (bloques) se recorta el archivo a los límites por usuario
+    COMPACTAR_CADA = 100
+    # Operaciones en espera antes de descartar (si el archivo sigue bloqueado)
+    MAX_PENDIENTES = 50000
+
+    def __init__(self, ruta: str):
+        super().__init__(ruta)
+        self._usuarios: OrderedDict[str, IndiceUsuario] = OrderedDict()
+        self._escrituras = 0
+        self._pendientes: list[tuple[str, tuple]] = []
+        self.consultas = 0
+        self.aciertos = 0
+        self.ajustadas = 0
+        self.aprendidas = 0
+
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS indice_terminos ("
+            " usuario TEXT NOT NULL, termino TEXT NOT NULL, categoria TEXT NOT NULL,"
+            " votos INTEGER NOT NULL, visto REAL NOT NULL,"
+            " PRIMARY KEY (usuario, termino, categoria))"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS indice_categorias ("
+            " usuario TEXT NOT NULL, categoria TEXT NOT NULL, tipo TEXT NOT NULL,"
+            " votos INTEGER NOT NULL, visto REAL NOT NULL,"
+            " PRIMARY KEY (usuario, categoria, tipo))"
+        )
+        # Sin esto, con poco tráfico nunca se llegaría a COMPACTAR_CADA escrituras
+        self._compactar()
+
+    async def cargar(self, usuario: str) -> IndiceUsuario:
+        indice = self._usuarios.get(usuario)
+        if indice is not None:
+            self._usuarios.move_to_end(usuario)
+            if time.monotonic() - indice.cargado < INDICE_RECARGA_SEGUNDOS:
+                return indice
+            return await self._recargar(indice)
+
+        leido = await asyncio.to_thread(self._leer_usuario, usuario)
+
+        # Otra petición del mismo usuario pudo cargarlo mientras tanto: gana la que ya aprendió
+        indice = self._usuarios.setdefault(usuario, leido)
+        self._usuarios.move_to_end(usuario)
+        while len(self._usuarios) > INDICE_USUARIOS_EN_MEMORIA:
+            self._usuarios.popitem(last=False)
+
+        return indice
+
+    async def _recargar(self, indice: IndiceUsuario) -> IndiceUsuario:
+        """
+        Relee al usuario para ver lo que escribieron otros workers. Si lo
+        aprendido aquí aún no está en disco (o se aprende durante la
+        lectura), se sigue con la copia en memoria y se reintenta después.
+        """
+        escribir_en = indice.escribir_en
+        if escribir_en > self._bloques_escritos:
+            return indice
+
+        leido = await asyncio.to_thread(self._leer_usuario, indice.usuario)
+        if indice.escribir_en != escribir_en or self._usuarios.get(indice.usuario) is not indice:
+            return indice
+
+        self._usuarios[indice.usuario] = leido
+        return leido
+
+    def _leer_usuario(self, usuario: str) -> IndiceUsuario:
+        indice = IndiceUsuario(usuario)
+        with self._lock:
+            categorias = self._conn.execute(
+                "SELECT categoria, tipo, votos FROM indice_categorias WHERE usuario = ? ORDER BY visto",
+                (usuario,)
+            ).fetchall()
+            terminos = self._conn.execute(
+                "SELECT termino, categoria, votos FROM indice_terminos WHERE usuario = ? ORDER BY visto",
+                (usuario,)
+            ).fetchall()
+
+        for categoria, tipo, votos in categorias:
+            indice.votar_categoria(categoria, tipo if tipo in ("income", "expense") else None, votos)
+        for termino, categoria, votos in terminos:
+            if categoria in indice.categorias:
+                indice.votar_termino(termino, categoria, votos)
+
+        # Otro worker pudo dejar más de lo permitido; lo sobrante se purga al compactar
+        while len(indice.terminos) > INDICE_MAX_TERMINOS:
+            indice.olvidar_termino(next(iter(indice.terminos)))
+        while len(indice.categorias) > INDICE_MAX_CATEGORIAS:
+            indice.olvidar_categoria(next(iter(indice.categorias)))
+
+        return indice
+
+    def buscar(self, indice: IndiceUsuario, mensaje: str) -> tuple[str, str | None] | None:
+        """
+        (categoría, tipo) si los términos del mensaje apuntan a una sola
+        categoría del usuario con suficientes votos; si no, None.
+        """
+        self.consultas += 1
+        if not indice.terminos:
+            return None
+
+        encontradas = {
+            categoria
+            for termino in extraer_terminos(normalizar_mensaje(mensaje))
+            if (categoria := indice.categoria_de(termino))
+        }
+        if len(encontradas) != 1:
+            return None
+
+        categoria = encontradas.pop()
+        self.aciertos += 1
+        return categoria, indice.tipo_de(categoria)
+
+    def ajustar(self, indice: IndiceUsuario, categoria: str) -> str:
+        """Une una categoría nueva a la existente del usuario que más se le parece."""
+        existente = indice.canonica(categoria)
+        if existente is None or existente == categoria:
+            return categoria
+
+        self.ajustadas += 1
+        return existente
+
+    def aprender(self, indice: IndiceUsuario, mensaje: str, categoria: str, tipo: str | None):
+        """Actualiza la memoria al momento y deja la escritura para escribir_pendientes."""
+        usuario = indice.usuario
+        ahora = time.time()
+        operaciones: list[tuple[str, tuple]] = []
+
+        categoria = indice.canonica(categoria) or categoria
+        indice.votar_categoria(categoria, tipo)
+        operaciones.append((
+            "INSERT INTO indice_categorias (usuario, categoria, tipo, votos, visto) VALUES (?, ?, ?, 1, ?)"
+            " ON CONFLICT (usuario, categoria, tipo) DO UPDATE SET votos = votos + 1, visto = excluded.visto",
+            (usuario, categoria, tipo or "", ahora)
+        ))
+
+        while len(indice.categorias) > INDICE_MAX_CATEGORIAS:
+            vieja = next(iter(indice.categorias))
+            indice.olvidar_categoria(vieja)
+            operaciones.append(("DELETE FROM indice_categorias WHERE usuario = ? AND categoria = ?", (usuario, vieja)))
+            operaciones.append(("DELETE FROM indice_terminos WHERE usuario = ? AND categoria = ?", (usuario, vieja)))
+
+        for termino in dict.fromkeys(extraer_terminos(normalizar_mensaje(mensaje))):
+            indice.votar_termino(termino, categoria)
+            operaciones.append((
+                "INSERT INTO indice_terminos (usuario, termino, categoria, votos, visto) VALUES (?, ?, ?, 1, ?)"
+                " ON CONFLICT (usuario, termino, categoria) DO UPDATE SET votos = votos + 1, visto = excluded.visto",
+                (usuario, termino, categoria, ahora)
+            ))
+
+            # Contador saturado: se parte a la mitad para que un cambio de hábito pueda ganar
+            votos = indice.terminos[termino]
+            if sum(votos.values()) >= INDICE_VOTOS_MAX:
+                for c in list(votos):
+                    votos[c] //= 2
+                    if not votos[c]:
+                        del votos[c]
+                operaciones.append(("UPDATE indice_terminos SET votos = votos / 2 WHERE usuario = ? AND termino = ?", (usuario, termino)))
+                operaciones.append(("DELETE FROM indice_terminos WHERE usuario = ? AND termino = ? AND votos = 0", (usuario, termino)))
+                if not votos:
+                    indice.olvidar_termino(termino)
+
+        while len(indice.terminos) > INDICE_MAX_TERMINOS:
+            viejo = next(iter(indice.terminos))
+            indice.olvidar_termino(viejo)
+            operaciones.append(("DELETE FROM indice_terminos WHERE usuario = ? AND termino = ?", (usuario, viejo)))
+
+        if len(self._pendientes) + len(operaciones) > self.MAX_PENDIENTES:
+            # El archivo no da abasto: se pierde este aprendizaje en disco, la memoria ya lo tiene
+            self.descartadas += 1
+        else:
+            self._pendientes.extend(operaciones)
+            self.hay_pendientes.set()
+            indice.escribir_en = self._bloques_tomados + 1
+
+        self.aprendidas += 1
+
+    def _tomar_pendientes(self) -> list[tuple[str, tuple]]:
+        operaciones, self._pendientes = self._pendientes, []
+        return operaciones
+
+    def _escribir_bloque(self, operaciones: list[tuple[str, tuple]]):
+        if not operaciones:
+            return
+
+        with self._lock:
+            with transaccion(self._conn):
+                for sql, parametros in operaciones:
+                    self._conn.execute(sql, parametros)
+
+            self._escrituras += 1
+            if self._escrituras % self.COMPACTAR_CADA == 0:
+                self._compactar()
+
+    def _compactar(self):
+        """
+        Borra los usuarios sin actividad en INDICE_TTL_SEGUNDOS (tokens que ya
+        no se usan) y recorta a los demás a sus límites, incluido lo que
+        dejaron otros workers.
+        """
+        self._conn.execute(
+            "DELETE FROM indice_categorias WHERE usuario IN ("
+            " SELECT usuario FROM indice_categorias GROUP BY usuario HAVING MAX(visto) < ?)",
+            (time.time() - INDICE_TTL_SEGUNDOS,)
+        )
+        self._conn.execute(
+            "DELETE FROM indice_categorias WHERE (usuario, categoria) IN ("
+            " SELECT usuario, categoria FROM ("
+            "  SELECT usuario, categoria, ROW_NUMBER() OVER (PARTITION BY usuario ORDER BY MAX(visto) DESC) AS n"
+            "  FROM indice_categorias GROUP BY usuario, categoria)"
+            " WHERE n > ?)",
+            (INDICE_MAX_CATEGORIAS,)
+        )
+        self._conn.execute(
+            "DELETE FROM indice_terminos WHERE votos <= 0 OR NOT EXISTS ("
+            " SELECT 1 FROM indice_categorias c"
+            " WHERE c.usuario = indice_terminos.usuario AND c.categoria = indice_terminos.categoria)"
+        )
+        self._conn.execute(
+            "DELETE FROM indice_terminos WHERE (usuario, termino) IN ("
+            " SELECT usuario, termino FROM ("
+            "  SELECT usuario, termino, ROW_NUMBER() OVER (PARTITION BY usuario ORDER BY MAX(visto) DESC) AS n"
+            "  FROM indice_terminos GROUP BY usuario, termino)"
+            " WHERE n > ?)",
+            (INDICE_MAX_TERMINOS,)
+        )
+
+    def estadisticas(self) -> dict:
+        with self._lock:
+            usuarios, terminos = self._conn.execute(
+                "SELECT COUNT(DISTINCT usuario), COUNT(DISTINCT usuario || ' ' || termino) FROM indice_terminos"
+            ).fetchone()
+        return {
+            "usuarios": usuarios,
+            "terminos": terminos,
+            "usuarios_en_memoria": len(self._usuarios),
+            "consultas": self.consultas,
+            "aciertos": self.aciertos,
+            "tasa_aciertos": round(self.aciertos / self.consultas, 4) if self.consultas else 0.0,
+            "categorias_ajustadas": self.ajustadas,
+            "clasificaciones_aprendidas": self.aprendidas,
+            "escrituras_pendientes": len(self._pendientes),
+            "escrituras_descartadas": self.descartadas
+        }
+
+
+def crear_indice_categorias() -> IndiceCategorias:
+    try:
+        return IndiceCategorias(INDICE_CATEGORIAS_RUTA)
+    except Exception as e:
+        log.error("❌ No se pudo abrir el índice de categorías, se usa uno en memoria: %s", e)
+        return IndiceCategorias(":memory:")
+
+
+# Se reemplaza por el de INDICE_CATEGORIAS_RUTA al arrancar la app (lifespan)
+indice_categorias = IndiceCategorias(":memory:")
+
+
+def aplicar_indice_usuario(indice: IndiceUsuario, mensaje: str, analisis: dict, conocida: tuple | None) -> dict:
+    """
+    Pone la categoría en el vocabulario del usuario (conocida: lo que el
+    índice ya sabía del mensaje; si no, su categoría más parecida) y aprende
+    del resultado. No modifica el dict recibido: puede venir de la caché.
+    """
+    if analisis["ofensivo"] or not analisis.get("categoria"):
+        return analisis
+
+    with metricas.medir("indice_categorias_aprendizaje"):
+        categoria = conocida[0] if conocida else indice_categorias.ajustar(indice, analisis["categoria"])
+
+        # Lo que salió del respaldo local no se aprende
+        if not analisis.get("degradado") and categoria != "SinCategoria":
+            indice_categorias.aprender(indice, mensaje, categoria, analisis["type"])
+
+    if categoria == analisis["categoria"]:
+        return analisis
+    return {**analisis, "categoria": categoria}
+
+
 # =====================================================
-def contiene_groserias_IA(texto: str) -> bool:
+# 🔥 CAPA DE LLAMADAS A GROQ
+# =====================================================
+class GroqNoDisponible(Exception):
+    """Groq no se consultó o falló: hay que usar el respaldo local."""
+
+
+PATRON_DURACION = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+
+
+def leer_duracion(valor: str | None) -> float | None:
+    """Convierte "2m59.56s", "7.66s" o "250ms" (formato de Groq) a segundos."""
+    if not valor:
+        return None
+
+    try:
+        return float(valor)
+    except ValueError:
+        pass
+
+    unidades = {"h": 3600, "m": 60, "s": 1, "ms": 0.001}
+    partes = PATRON_DURACION.findall(valor)
+    return sum(float(n) * unidades[u] for n, u in partes) if partes else None
+
+
+def leer_entero(valor: str | None) -> int | None:
+    try:
+        return int(valor)
+    except (TypeError, ValueError):
+        return None
+
+
+class LimitadorAdaptativo:
+    """
+    Cubeta de fichas (como GCRA) con tasa AIMD: se reduce a la mitad ante un
+    429 y crece poco a poco con cada éxito hasta GROQ_LIMITE_RPM. Además se
+    pausa cuando las cabeceras x-ratelimit-* de Groq dicen que no queda cupo.
+    """
+
+    def __init__(self, rpm: float, espera_max: float):
+        self.tasa_max = max(rpm / 60, 0.01)
+        self.tasa = self.tasa_max
+        self.rafaga = max(self.tasa_max, 1.0)
+        self.espera_max = espera_max
+        self.siguiente = 0.0
+        self.pausa_hasta = 0.0
+
+    async def esperar(self):
+        ahora = time.monotonic()
+        inicio = max(self.siguiente, ahora, self.pausa_hasta)
+        espera = max(inicio - ahora - (self.rafaga - 1) / self.tasa, self.pausa_hasta - ahora, 0)
+
+        if espera > self.espera_max:
+            raise GroqNoDisponible(f"Límite de peticiones: habría que esperar {espera:.1f}s")
+
+        self.siguiente = inicio + 1 / self.tasa
+        if espera > 0:
+            await asyncio.sleep(espera)
+
+    def pausar(self, segundos: float):
+        self.pausa_hasta = max(self.pausa_hasta, time.monotonic() + segundos)
+
+    def registrar_exito(self, headers):
+        self.tasa = min(self.tasa_max, self.tasa + self.tasa_max * 0.05)
+
+        if leer_entero(headers.get("x-ratelimit-remaining-requests")) == 0:
+            self.pausar(leer_duracion(headers.get("x-ratelimit-reset-requests")) or 1)
+
+        restantes = leer_entero(headers.get("x-ratelimit-remaining-tokens"))
+        if restantes is not None and restantes < GROQ_MARGEN_TOKENS:
+            self.pausar(leer_duracion(headers.get("x-ratelimit-reset-tokens")) or 1)
+
+    def registrar_limite(self, headers):
+        self.tasa = max(self.tasa / 2, self.tasa_max * 0.05)
+        self.pausar(
+            leer_duracion(headers.get("retry-after"))
+            or leer_duracion(headers.get("x-ratelimit-reset-tokens"))
+            or 1
+        )
+
+    def estado(self) -> dict:
+        return {
+            "rpm_actual": round(self.tasa * 60, 2),
+            "rpm_max": round(self.tasa_max * 60, 2),
+            "pausa_restante_segundos": round(max(self.pausa_hasta - time.monotonic(), 0), 3)
+        }
+
+
+class CircuitoGroq:
+    """
+    Cerrado → abierto tras GROQ_CIRCUITO_FALLOS fallos seguidos. Abierto
+    falla al instante durante GROQ_CIRCUITO_ESPERA; luego deja pasar una
+    sola llamada de prueba (semiabierto) que decide si cierra o reabre.
+    """
+
+    def __init__(self, umbral: int, espera: float):
+        self.umbral = umbral
+        self.espera = espera
+        self.estado = "cerrado"
+        self.fallos = 0
+        self.abierto_hasta = 0.0
+        self.prueba_en_curso = False
+
+    def permitir(self):
+        if self.estado == "abierto":
+            if time.monotonic() < self.abierto_hasta:
+                raise GroqNoDisponible("Circuito abierto")
+            self.estado = "semiabierto"
+            self.prueba_en_curso = False
+
+        if self.estado == "semiabierto":
+            if self.prueba_en_curso:
+                raise GroqNoDisponible("Circuito semiabierto, prueba en curso")
+            self.prueba_en_curso = True
+
+    def exito(self):
+        if self.estado != "cerrado":
+            log.info("✅ Circuito de Groq cerrado")
+        self.estado = "cerrado"
+        self.fallos = 0
+        self.prueba_en_curso = False
+
+    def fallo(self):
+        self.fallos += 1
+        self.prueba_en_curso = False
+        if self.estado == "semiabierto" or self.fallos >= self.umbral:
+            if self.estado != "abierto":
+                log.error("❌ Circuito de Groq abierto por %ss tras %s fallos", self.espera, self.fallos)
+            self.estado = "abierto"
+            self.abierto_hasta = time.monotonic() + self.espera
+
+    def liberar_prueba(self):
+        # La llamada de prueba se canceló sin resultado: otra puede intentarlo
+        self.prueba_en_curso = False
+
+
+limitador_groq = LimitadorAdaptativo(GROQ_LIMITE_RPM, GROQ_ESPERA_MAX)
+circuito_groq = CircuitoGroq(GROQ_CIRCUITO_FALLOS, GROQ_CIRCUITO_ESPERA)
+semaforo_groq = asyncio.Semaphore(GROQ_MAX_CONCURRENCIA)
+
+# Llamadas idénticas en vuelo: clave → [tarea, cuántos la esperan]
+vuelos_groq: dict[tuple, list] = {}
+
+estadisticas_groq = {"llamadas": 0, "deduplicadas": 0, "errores": 0, "limitadas": 0, "rechazadas": 0, "degradados": 0}
+
+
+async def _llamar_groq(kwargs: dict, etapa: str) -> str:
+
     if not client:
-        return False
+        raise GroqNoDisponible("Groq no configurado")
+
+    try:
+        circuito_groq.permitir()
+    except GroqNoDisponible:
+        estadisticas_groq["rechazadas"] += 1
+        raise
+
+    try:
+        # El limitador va antes del semáforo: así la cola de espera queda
+        # acotada por GROQ_ESPERA_MAX en vez de crecer detrás del semáforo
+        await limitador_groq.esperar()
+        async with semaforo_groq:
+            estadisticas_groq["llamadas"] += 1
+            # El error ya lo cuenta el medir(etapa) de llamar_groq
+            with metricas.medir(etapa, "groq_llamada_duracion_segundos", contar_errores=False):
+                raw = await client.chat.completions.with_raw_response.create(**kwargs)
+
+    except asyncio.CancelledError:
+        circuito_groq.liberar_prueba()
+        raise
+
+    except GroqNoDisponible:
+        circuito_groq.liberar_prueba()
+        estadisticas_groq["rechazadas"] += 1
+        raise
+
+    except groq.RateLimitError as e:
+        estadisticas_groq["limitadas"] += 1
+        limitador_groq.registrar_limite(e.response.headers)
+        circuito_groq.fallo()
+        raise GroqNoDisponible("Groq respondió 429") from e
+
+    except (groq.APIConnectionError, groq.InternalServerError) as e:
+        estadisticas_groq["errores"] += 1
+        circuito_groq.fallo()
+        raise GroqNoDisponible(f"Groq no responde: {e}") from e
+
+    except Exception:
+        # Errores 4xx de la petición: no dicen nada de la salud del servicio
+        estadisticas_groq["errores"] += 1
+        circuito_groq.liberar_prueba()
+        raise
+
+    limitador_groq.registrar_exito(raw.headers)
+    circuito_groq.exito()
+
+    res = await raw.parse()
+
+    uso = getattr(res, "usage", None)
+    if uso:
+        metricas.contar("groq_tokens_total", uso.prompt_tokens or 0, etapa=etapa, tipo="prompt")
+        metricas.contar("groq_tokens_total", uso.completion_tokens or 0, etapa=etapa, tipo="completion")
+        costo = ((uso.prompt_tokens or 0) * GROQ_PRECIO_PROMPT + (uso.completion_tokens or 0) * GROQ_PRECIO_COMPLETION) / 1e6
+        metricas.contar("groq_costo_total", costo, etapa=etapa)
+
+    return res.choices[0].message.content.strip()
+
+
+async def llamar_groq(prompt: str, etapa: str, temperature: float = 0, max_tokens: int = 20, formato_json=False) -> str:
+    """
+    Punto único de salida hacia Groq. Deduplica prompts idénticos en vuelo
+    (singleflight) y lanza GroqNoDisponible cuando hay que usar el respaldo.
+    """
+    kwargs = {
+        "model": GROQ_MODELO,
+        "messages": [{"role": "user", "content": prompt}],
+        "temperature": temperature,
+        "max_tokens": max_tokens
+    }
+    if formato_json:
+        kwargs["response_format"] = {"type": "json_object"}
+
+    clave = (GROQ_MODELO, prompt, temperature, max_tokens, formato_json)
+
+    vuelo = vuelos_groq.get(clave)
+    # Un vuelo ya cancelado (se fue su último interesado) no sirve para
+    # unirse: el nuevo interesado recibiría un CancelledError ajeno
+    if vuelo is None or vuelo[0].cancelling() or vuelo[0].cancelled():
+        vuelo = [asyncio.create_task(_llamar_groq(kwargs, etapa)), 0]
+        vuelos_groq[clave] = vuelo
+        vuelo[0].add_done_callback(
+            lambda _: vuelos_groq.pop(clave) if vuelos_groq.get(clave) is vuelo else None
+        )
+    else:
+        estadisticas_groq["deduplicadas"] += 1
+
+    vuelo[1] += 1
+    try:
+        # shield: cancelar a un interesado no cancela la llamada de los demás
+        with metricas.medir(etapa):
+            return await asyncio.shield(vuelo[0])
+    finally:
+        vuelo[1] -= 1
+        if vuelo[1] == 0:
+            # Se saca del mapa antes de cancelar, sin esperar al done-callback
+            if vuelos_groq.get(clave) is vuelo:
+                del vuelos_groq[clave]
+            cancelar_tareas(vuelo[0])
+
+
+# =====================================================
+# 🔥 DETECCIÓN DE GROCERÍAS / CONTENIDO OFENSIVO (IA)
+# =====================================================
+async def contiene_groserias_IA(texto: str) -> bool:
 
     prompt = f"""
     Determina si este mensaje contiene groserías, vulgaridades, insultos,
@@ -84,30 +1650,17 @@ def contiene_groserias_IA(texto: str) -> bool:
     Mensaje: "{texto}"
     """
 
-    try:
-        res = client.chat.completions.create(
-            model="llama-3.1-8b-instant",
-            messages=[{"role": "user", "content": prompt}],
-            temperature=0,
-            max_tokens=20
-        )
-
-        raw = res.choices[0].message.content.strip()
-        print("🟥 Filtro ofensivo IA RAW:", raw)
+    raw = await llamar_groq(prompt, "ofensivo", temperature=0, max_tokens=20)
+    log.debug("🟥 Filtro ofensivo IA RAW: %s", raw)
 
-        data = json.loads(raw)
-        return data.get("ofensivo", False)
-
-    except:
-        return False
+    data = json.loads(raw)
+    return data.get("ofensivo", False)
 
 
 # =====================================================
 # 🔥 DETECCIÓN DOBLE SENTIDO (SOLO ADVERTENCIA)
 # =====================================================
-def contiene_doble_sentido_IA(texto: str) -> bool:
-    if not client:
-        return False
+async def contiene_doble_sentido_IA(texto: str) -> bool:
 
     prompt = f"""
     Determina si el mensaje contiene doble sentido, frases con
@@ -121,30 +1674,17 @@ def contiene_doble_sentido_IA(texto: str) -> bool:
     Mensaje: "{texto}"
     """
 
-    try:
-        res = client.chat.completions.create(
-            model="llama-3.1-8b-instant",
-            messages=[{"role": "user", "content": prompt}],
-            temperature=0,
-            max_tokens=20
-        )
-
-        raw = res.choices[0].message.content.strip()
-        print("🟨 Doble sentido IA RAW:", raw)
-
-        data = json.loads(raw)
-        return data.get("doble_sentido", False)
+    raw = await llamar_groq(prompt, "doble_sentido", temperature=0, max_tokens=20)
+    log.debug("🟨 Doble sentido IA RAW: %s", raw)
 
-    except:
-        return False
+    data = json.loads(raw)
+    return data.get("doble_sentido", False)
 
 
 # =====================================================
 # 🔥 DETECCIÓN INGRESO/GASTO
 # =====================================================
-def clasificar_tipo_IA(mensaje: str) -> str:
-    if not client:
-        return "expense"
+async def clasificar_tipo_IA(mensaje: str) -> str:
 
     prompt = f"""
     Determina si esta transacción es ingreso o gasto.
@@ -157,40 +1697,40 @@ def clasificar_tipo_IA(mensaje: str) -> str:
     Mensaje: "{mensaje}"
     """
 
-    try:
-        res = client.chat.completions.create(
-            model="llama-3.1-8b-instant",
-            messages=[{"role": "user", "content": prompt}],
-            temperature=0,
-            max_tokens=20
-        )
+    raw = await llamar_groq(prompt, "tipo", temperature=0, max_tokens=20)
 
-        data = json.loads(res.choices[0].message.content.strip())
-        tipo = data.get("type", "expense")
+    data = json.loads(raw)
+    tipo = data.get("type", "expense")
 
-        print("🟩 Tipo IA:", tipo)
+    log.debug("🟩 Tipo IA: %s", tipo)
 
-        return tipo
-
-    except:
-        return "expense"
+    return tipo
 
 
 # =====================================================
 # 🔥 CREACIÓN DE CATEGORÍAS (LIBRE)
 # =====================================================
-def clasificar_categoria_IA(mensaje: str) -> str:
+def instruccion_categorias(categorias: list[str] | None) -> str:
+    """Línea del prompt con las categorías que el usuario ya usa, si tiene."""
+    if not categorias:
+        return ""
+    return (
+        "Si una de estas categorías que el usuario ya usa describe la transacción,"
+        f" responde con ella tal cual: {json.dumps(categorias, ensure_ascii=False)}."
+        " Si ninguna sirve, crea una nueva."
+    )
+
+
+async def clasificar_categoria_IA(mensaje: str, categorias: list[str] | None = None) -> str:
     """
-    La IA crea UNA categoría nueva basada solo en el mensaje.
-    Sin listas, sin ejemplos, sin categorías existentes.
+    La IA crea UNA categoría basada solo en el mensaje, sin listas ni
+    ejemplos. categorias: las que el usuario ya usa, para que Groq
+    reutilice una en vez de inventar un sinónimo ("Uber" vs "Transporte").
     """
 
-    if not client:
-        return "SinCategoria"
-
     prompt = f"""
     Crea una categoría de UNA sola palabra que describa el gasto o ingreso.
-    No uses listas existentes.
+    {instruccion_categorias(categorias) or "No uses listas existentes."}
     No inventes frases largas.
     No uses "Otros".
     La categoría debe ser concreta y relacionada al mensaje.
@@ -203,72 +1743,1102 @@ def clasificar_categoria_IA(mensaje: str) -> str:
     Mensaje: "{mensaje}"
     """
 
-    try:
-        res = client.chat.completions.create(
-            model="llama-3.1-8b-instant",
-            messages=[{"role": "user", "content": prompt}],
-            temperature=0.2,
-            max_tokens=25
-        )
-
-        data = json.loads(res.choices[0].message.content.strip())
-        categoria = data.get("categoria", "SinCategoria")
+    raw = await llamar_groq(prompt, "categoria", temperature=0.2, max_tokens=25)
 
-        categoria = categoria.replace(" ", "")
+    data = json.loads(raw)
+    categoria = data.get("categoria", "SinCategoria")
 
-        print("🟦 Categoría IA:", categoria)
+    # Sin espacios no puede quedar vacía: una respuesta en blanco es SinCategoria
+    categoria = categoria.replace(" ", "") or "SinCategoria"
 
-        return categoria
+    log.debug("🟦 Categoría IA: %s", categoria)
 
-    except:
-        return "SinCategoria"
+    return categoria
 
 
 # =====================================================
-# 🔥 CLASIFICADOR LOCAL
+# 🔥 CLASIFICACIÓN FUSIONADA (UNA SOLA CONSULTA)
 # =====================================================
-def clasificador_local(mensaje: str):
+async def clasificar_fusionado_IA(mensaje: str, categorias: list[str] | None = None) -> dict:
+    """
+    Obtiene ofensivo, doble sentido, tipo y categoría en una sola consulta.
+    Lanza excepción si la respuesta no cumple el esquema estricto.
+    """
 
-    match = re.search(r"\$?\s*([\d.,]+)", mensaje)
-    if not match:
-        raise HTTPException(400, "No se encontró monto")
+    prompt = f"""
+    Analiza este mensaje de una transacción financiera y determina:
+    - "ofensivo": si contiene groserías, vulgaridades, insultos, lenguaje
+      ofensivo, contenido sexual explícito o palabras inapropiadas.
+    - "doble_sentido": si contiene doble sentido, insinuación sexual
+      indirecta, albures mexicanos o lenguaje ambiguo.
+    - "type": si la transacción es ingreso ("income") o gasto ("expense").
+    - "categoria": UNA sola palabra concreta que describa el gasto o
+      ingreso. No uses "Otros" ni frases largas.
+      {instruccion_categorias(categorias)}
 
-    monto = float(match.group(1).replace(",", "").replace(".", ""))
-    if monto <= 0:
-        raise HTTPException(400, "Monto inválido")
+    Responde SOLO con JSON estricto:
+    {{
+        "ofensivo": true or false,
+        "doble_sentido": true or false,
+        "type": "income" | "expense",
+        "categoria": "UnaPalabra"
+    }}
+
+    Mensaje: "{mensaje}"
+    """
 
-    tipo = clasificar_tipo_IA(mensaje)
-    categoria = clasificar_categoria_IA(mensaje)
+    raw = await llamar_groq(prompt, "fusionado", temperature=0, max_tokens=60, formato_json=True)
+    log.debug("🟪 Fusionado IA RAW: %s", raw)
 
-    return tipo, categoria, monto, mensaje.capitalize()
+    analisis = AnalisisFusionado.model_validate_json(raw).model_dump()
+    analisis["categoria"] = analisis["categoria"].replace(" ", "")
+    analisis["degradado"] = False
+
+    return analisis
 
 
 # =====================================================
-# 🔥 FUNCIÓN PRINCIPAL
+# 🔥 CLASIFICACIÓN EN LOTE (VARIOS MENSAJES POR CONSULTA)
 # =====================================================
-def clasificar_gasto(mensaje: str, token: str, advertencia=None):
+async def clasificar_lote_IA(mensajes: list[str], categorias: list[str] | None = None) -> list[dict | None]:
+    """
+    Analiza varios mensajes en una sola consulta. Cada elemento se valida
+    por separado; los que falten o no cumplan el esquema quedan en None.
+    """
 
-    ahora = datetime.now()
-    tipo, categoria, monto, descripcion = clasificador_local(mensaje)
+    entrada = json.dumps(
+        [{"id": i, "mensaje": m} for i, m in enumerate(mensajes)],
+        ensure_ascii=False
+    )
+
+    prompt = f"""
+    Analiza cada uno de estos mensajes de transacciones financieras y
+    determina para cada uno:
+    - "ofensivo": si contiene groserías, vulgaridades, insultos, lenguaje
+      ofensivo, contenido sexual explícito o palabras inapropiadas.
+    - "doble_sentido": si contiene doble sentido, insinuación sexual
+      indirecta, albures mexicanos o lenguaje ambiguo.
+    - "type": si la transacción es ingreso ("income") o gasto ("expense").
+    - "categoria": UNA sola palabra concreta que describa el gasto o
+      ingreso. No uses "Otros" ni frases largas.
+      {instruccion_categorias(categorias)}
+
+    Responde SOLO con JSON estricto, un resultado por mensaje con su mismo id:
+    {{
+        "resultados": [
+            {{
+                "id": 0,
+                "ofensivo": true or false,
+                "doble_sentido": true or false,
+                "type": "income" | "expense",
+                "categoria": "UnaPalabra"
+            }}
+        ]
+    }}
+
+    Mensajes: {entrada}
+    """
+
+    raw = await llamar_groq(prompt, "lote", temperature=0, max_tokens=20 + 45 * len(mensajes), formato_json=True)
+    log.debug("🟫 Lote IA RAW: %s", raw)
+
+    datos = json.loads(raw)
+    items = datos.get("resultados") if isinstance(datos, dict) else None
+    if not isinstance(items, list):
+        raise ValueError("La respuesta del lote no trae 'resultados'")
+
+    resultados: list[dict | None] = [None] * len(mensajes)
+    for item in items:
+        try:
+            analisis = AnalisisLoteItem.model_validate(item)
+        except ValidationError:
+            continue
+
+        if 0 <= analisis.id < len(mensajes) and resultados[analisis.id] is None:
+            datos = analisis.model_dump(exclude={"id"})
+            datos["categoria"] = datos["categoria"].replace(" ", "")
+            datos["degradado"] = False
+            resultados[analisis.id] = datos
+
+    return resultados
+
+
+def partir_en_prompts(mensajes: list[str]) -> list[list[int]]:
+    """
+    Agrupa índices de mensajes respetando LOTE_MENSAJES_POR_PROMPT y un
+    presupuesto aproximado de tokens (~4 caracteres por token).
+    """
+    grupos, actual, tokens = [], [], 0
+
+    for i, mensaje in enumerate(mensajes):
+        costo = len(mensaje) // 4 + 12
+        if actual and (len(actual) >= LOTE_MENSAJES_POR_PROMPT or tokens + costo > LOTE_PRESUPUESTO_TOKENS):
+            grupos.append(actual)
+            actual, tokens = [], 0
+        actual.append(i)
+        tokens += costo
+
+    if actual:
+        grupos.append(actual)
+
+    return grupos
+
+
+async def analizar_lote_con_groq(
+    mensajes: list[str],
+    conocidas: list[tuple | None] | None = None,
+    categorias: list[str] | None = None,
+    usuario: str | None = None
+) -> list[dict]:
+    """
+    Clasifica con Groq empaquetando varios mensajes por consulta. Lo que
+    el lote no resuelva se analiza de forma individual (conocidas: lo que
+    el índice del usuario sabe de cada mensaje; categorias: las que usa;
+    usuario: a nombre de quién se guardan en la caché).
+    """
+
+    async def analizar_grupo(indices: list[int]) -> list[dict]:
+        grupo = [mensajes[i] for i in indices]
+        resultados: list[dict | None] = [None] * len(grupo)
+
+        if len(grupo) > 1:
+            try:
+                resultados = await clasificar_lote_IA(grupo, categorias)
+
+            # Mismo criterio que analizar_fusionado: otra consulta sólo si Groq respondió
+            except (ValidationError, json.JSONDecodeError, ValueError) as e:
+                log.warning("⚠ Respuesta de lote inválida, se analiza uno por uno: %s", e)
+
+            except Exception as e:
+                registrar_respaldo("lote", e)
+                estadisticas_groq["degradados"] += len(grupo)
+                resultados = [
+                    respaldo_local(mensaje, conocidas[i] if conocidas else None)
+                    for i, mensaje in zip(indices, grupo)
+                ]
+
+        # La respuesta del lote sale de un prompt fusionado: en modo "separado"
+        # no se guarda, para no mezclarla con las de ese modo en la caché
+        for mensaje, analisis in zip(grupo, resultados):
+            if analisis is not None:
+                guardar_analisis(mensaje, analisis, MODO_CLASIFICACION == "fusionado", usuario)
+
+        faltantes = [i for i, analisis in enumerate(resultados) if analisis is None]
+        individuales = await asyncio.gather(*(
+            analizar_con_groq(grupo[i], conocidas[indices[i]] if conocidas else None, None, categorias, usuario)
+            for i in faltantes
+        ))
+        for i, analisis in zip(faltantes, individuales):
+            resultados[i] = analisis
+
+        return resultados
+
+    grupos = partir_en_prompts(mensajes)
+    resultados = await asyncio.gather(*(analizar_grupo(indices) for indices in grupos))
+
+    analisis_por_indice: list[dict] = [None] * len(mensajes)
+    for indices, analisis_grupo in zip(grupos, resultados):
+        for i, analisis in zip(indices, analisis_grupo):
+            analisis_por_indice[i] = analisis
+
+    return analisis_por_indice
+
+
+# =====================================================
+# 🔥 ANÁLISIS DEL MENSAJE
+# =====================================================
+def registrar_respaldo(campo: str, e: Exception):
+    """Log y métrica de una consulta a Groq que se resuelve con el respaldo local."""
+    # Con el circuito abierto o sin Groq es lo esperado: no se llena el log
+    nivel = logging.DEBUG if isinstance(e, GroqNoDisponible) else logging.WARNING
+    log.log(nivel, "⚠ Groq no resolvió '%s', se usa el respaldo local: %s", campo, e)
+    metricas.contar("ia_respaldos_total", campo=campo)
 
-    data = {
-        "type": tipo,
-        "amount": monto,
-        "category": categoria,
-        "descripcion": descripcion,
-        "date": ahora.strftime("%Y-%m-%dT%H:%M:%S"),
-        "advertencia": advertencia
-    }
 
-    print("📤 ENVIANDO:", data)
+async def esperar_campo(tarea: asyncio.Task, campo: str, fallidos: list):
+    """Resultado de una consulta separada, o None si hay que usar el respaldo."""
+    try:
+        return await tarea
+    except Exception as e:
+        registrar_respaldo(campo, e)
+        fallidos.append(campo)
+        return None
+
+
+async def analizar_separado(
+    mensaje: str, categoria_conocida: str | None = None, tipo_conocido: str | None = None, categorias: list[str] | None = None
+) -> dict:
+
+    # Las cuatro consultas son independientes: se lanzan a la vez y la
+    # latencia total queda en una sola ida y vuelta a Groq.
+    tarea_ofensivo = asyncio.create_task(contiene_groserias_IA(mensaje))
+    tarea_doble = asyncio.create_task(contiene_doble_sentido_IA(mensaje))
+    tarea_tipo = None if tipo_conocido else asyncio.create_task(clasificar_tipo_IA(mensaje))
+    # Si el índice del usuario ya conoce el comercio, la categoría no se le pregunta a Groq
+    tarea_categoria = None if categoria_conocida else asyncio.create_task(clasificar_categoria_IA(mensaje, categorias))
+    tareas = [t for t in (tarea_ofensivo, tarea_doble, tarea_tipo, tarea_categoria) if t]
+
+    # Lo que Groq no resuelva sale del clasificador local (aunque tenga poca confianza)
+    respaldo, _ = clasificador_local(mensaje)
+    fallidos = []
+
+    try:
+        ofensivo = await esperar_campo(tarea_ofensivo, "ofensivo", fallidos)
+        if ofensivo is None:
+            ofensivo = respaldo["ofensivo"]
+
+        # Si es ofensivo el resto no se usa: se cancela en el finally
+        if ofensivo:
+            return {"ofensivo": True, "doble_sentido": False, "type": None, "categoria": None, "degradado": bool(fallidos)}
+
+        doble_sentido = await esperar_campo(tarea_doble, "doble_sentido", fallidos)
+        tipo = tipo_conocido or await esperar_campo(tarea_tipo, "type", fallidos)
+        categoria = categoria_conocida or await esperar_campo(tarea_categoria, "categoria", fallidos)
+
+    finally:
+        cancelar_tareas(*tareas)
+
+    if fallidos:
+        estadisticas_groq["degradados"] += 1
+
+    return {
+        "ofensivo": False,
+        "doble_sentido": respaldo["doble_sentido"] if doble_sentido is None else doble_sentido,
+        "type": (respaldo["type"] or "expense") if tipo is None else tipo,
+        "categoria": (respaldo["categoria"] or "SinCategoria") if categoria is None else categoria,
+        "degradado": bool(fallidos)
+    }
+
+
+async def analizar_fusionado(mensaje: str, categorias: list[str] | None = None) -> dict:
 
     try:
-        headers = {"Authorization": token, "Content-Type": "application/json"}
-        requests.post(BACKEND_URL, json=data, headers=headers, timeout=10)
+        return await clasificar_fusionado_IA(mensaje, categorias)
+
+    except (ValidationError, json.JSONDecodeError) as e:
+        # Groq respondió, pero no con el esquema: vale la pena preguntar campo por campo
+        log.warning("⚠ Respuesta fusionada inválida, se usan consultas separadas: %s", e)
+        return await analizar_separado(mensaje, categorias=categorias)
+
     except Exception as e:
-        print("⚠ Error enviando al backend:", e)
+        # Groq caído o limitando: cuatro consultas más sólo empeorarían las cosas
+        registrar_respaldo("fusionado", e)
+        estadisticas_groq["degradados"] += 1
+
+    return respaldo_local(mensaje)
+
+
+def respaldo_local(mensaje: str, conocida: tuple | None = None) -> dict:
+    """Análisis completo del clasificador local para cuando Groq no respondió."""
+    respaldo, _ = clasificador_local(mensaje, conocida)
+    if respaldo["ofensivo"]:
+        return {**respaldo, "degradado": True}
+
+    return {
+        **respaldo,
+        "type": respaldo["type"] or "expense",
+        "categoria": respaldo["categoria"] or "SinCategoria",
+        "degradado": True
+    }
+
+
+def clave_cache(mensaje: str, usuario: str | None = None) -> str:
+    # Lo que Groq clasificó con las categorías de un usuario sólo le sirve a él
+    if usuario:
+        return f"{MODO_CLASIFICACION}:{usuario}:{normalizar_mensaje(mensaje)}"
+    return f"{MODO_CLASIFICACION}:{normalizar_mensaje(mensaje)}"
+
+
+async def analizar_sin_red(
+    mensaje: str, conocida: tuple | None = None, tipo: str | None = None, usuario: str | None = None
+) -> dict | None:
+    """
+    Niveles de la cascada que no tocan la red: clasificador local (con lo
+    que el índice del usuario sabe del mensaje) y caché (la del usuario, si
+    se le da). Devuelve None si hace falta consultar a Groq.
+    """
+    with metricas.medir("clasificador_local"):
+        analisis, confianza = clasificador_local(mensaje, conocida, tipo)
+    if confianza >= UMBRAL_CONFIANZA_LOCAL:
+        niveles_resueltos["local"] += 1
+        return analisis
+
+    with metricas.medir("cache"):
+        analisis = await cache.obtener(clave_cache(mensaje, usuario))
+    if analisis is not None:
+        niveles_resueltos["cache"] += 1
+        return analisis
+
+    return None
+
+
+def guardar_analisis(mensaje: str, analisis: dict, cachear: bool = True, usuario: str | None = None):
+
+    # Los análisis degradados (respaldo local) no cuentan como de Groq ni se guardan
+    if analisis.get("degradado"):
+        niveles_resueltos["respaldo"] += 1
+        return
+
+    niveles_resueltos["groq"] += 1
+    if cachear:
+        cache.guardar(clave_cache(mensaje, usuario), analisis)
+
+
+async def analizar_con_groq(
+    mensaje: str,
+    conocida: tuple | None = None,
+    tipo: str | None = None,
+    categorias: list[str] | None = None,
+    usuario: str | None = None
+) -> dict:
+
+    if MODO_CLASIFICACION == "fusionado":
+        analisis = await analizar_fusionado(mensaje, categorias)
+    else:
+        analisis = await analizar_separado(mensaje, conocida and conocida[0], tipo, categorias)
+
+    # En modo separado la categoría del índice o el tipo del estado de cuenta
+    # sustituyen la respuesta de Groq: ese análisis no sirve para otra consulta
+    personal = (conocida or tipo) and MODO_CLASIFICACION != "fusionado"
+    guardar_analisis(mensaje, analisis, not personal, usuario)
+    return analisis
+
+
+async def analizar_mensaje(
+    mensaje: str,
+    conocida: tuple | None = None,
+    tipo: str | None = None,
+    categorias: list[str] | None = None,
+    usuario: str | None = None
+) -> dict:
+    """
+    Devuelve {"ofensivo", "doble_sentido", "type", "categoria"} recorriendo
+    la cascada: clasificador local → caché → Groq (según MODO_CLASIFICACION).
+    conocida es la (categoría, tipo) que el índice del usuario ya sabe; tipo,
+    el que dice el signo del monto importado (gana a cualquier nivel);
+    categorias, las del usuario que Groq debe preferir; usuario, el dueño de
+    sus entradas en la caché.
+    """
+    analisis = await analizar_sin_red(mensaje, conocida, tipo, usuario)
+    if analisis is None:
+        analisis = await analizar_con_groq(mensaje, conocida, tipo, categorias, usuario)
+
+    # Un acierto de caché o la consulta fusionada traen el tipo que dedujo Groq
+    if tipo and not analisis["ofensivo"] and analisis["type"] != tipo:
+        analisis = {**analisis, "type": tipo}
+    return analisis
+
+
+async def buscar_en_indice(token: str, mensajes: list[str]) -> tuple[IndiceUsuario, list[tuple | None], list[str]]:
+    """
+    Una sola búsqueda por mensaje en el índice del usuario del token.
+    Devuelve también sus categorías principales, para los prompts de Groq
+    (con ellas, sus análisis van a la caché con la clave del usuario).
+    """
+    indice = await indice_categorias.cargar(usuario_de_token(token))
+    with metricas.medir("indice_categorias_busqueda"):
+        conocidas = [indice_categorias.buscar(indice, mensaje) for mensaje in mensajes]
+        categorias = indice.principales(INDICE_CATEGORIAS_EN_PROMPT)
+    return indice, conocidas, categorias
+
+
+def cancelar_tareas(*tareas: asyncio.Task):
+    """
+    Cancela las tareas que siguen pendientes y recoge la excepción de las
+    que ya terminaron, para que asyncio no la reporte como no recuperada.
+    """
+    for tarea in tareas:
+        if not tarea.done():
+            tarea.cancel()
+        elif not tarea.cancelled():
+            tarea.exception()
+
+
+# =====================================================
+# 🔥 MONTO
+# =====================================================
+def leer_cifra(cifra: str) -> float:
+    """
+    Valor de una cifra con separadores: "50.50", "1,500", "1.234,50".
+    Con ambos separadores, el último es el decimal; con uno solo, es decimal
+    si aparece una vez y le siguen 1 o 2 cifras ("150.00"), si no es de miles ("1,500").
+    """
+    decimal = max(cifra.rfind("."), cifra.rfind(","))
+    if decimal >= 0 and not ("." in cifra and "," in cifra):
+        if cifra.count(cifra[decimal]) > 1 or len(cifra) - decimal - 1 not in (1, 2):
+            decimal = -1
+
+    if decimal >= 0:
+        entero, fraccion = cifra[:decimal], cifra[decimal + 1:]
+    else:
+        entero, fraccion = cifra, "0"
+    return float(entero.replace(".", "").replace(",", "") + "." + fraccion)
+
+
+def extraer_monto(mensaje: str) -> float:
+
+    match = PATRON_MONTO.search(mensaje)
+    if not match:
+        raise HTTPException(400, "No se encontró monto")
+
+    # El punto o la coma final es puntuación de la frase ("pagué 50.")
+    monto = leer_cifra(match.group(1).rstrip(".,"))
+
+    if monto <= 0:
+        raise HTTPException(400, "Monto inválido")
+
+    return monto
+
+
+PATRON_CELDA_MONTO = re.compile(r"^\+?\(?-?\(?([\d.,]*\d)\)?$")
+
+
+def tipo_por_signo(negativo: bool, positivo_explicito: bool) -> str | None:
+    """
+    Cargo (negativo) → gasto; abono con "+" → ingreso. Sin signo no se sabe:
+    hay estados de cuenta que ponen los cargos en positivo.
+    """
+    if negativo:
+        return "expense"
+    return "income" if positivo_explicito else None
+
+
+def leer_monto_celda(texto: str) -> tuple[float, str | None]:
+    """
+    Monto de una columna de estado de cuenta: "150.00", "1,234.50",
+    "1.234,50", "-150.00", "(150.00)", "+150.00", "$ 1,500". Devuelve el
+    valor absoluto y el tipo que indica el signo (ver tipo_por_signo).
+    """
+    limpio = texto.strip().replace("$", "").replace(" ", "").upper().removesuffix("MXN")
+    match = PATRON_CELDA_MONTO.match(limpio)
+    if not match:
+        raise HTTPException(400, "Monto inválido")
+
+    monto = leer_cifra(match.group(1))
+
+    if monto <= 0:
+        raise HTTPException(400, "Monto inválido")
+
+    return monto, tipo_por_signo("-" in limpio or "(" in limpio, limpio.startswith("+"))
+
+
+# =====================================================
+# 🔥 OUTBOX HACIA EL BACKEND
+# =====================================================
+class Outbox:
+    """
+    Cola persistente en SQLite. Una transacción aceptada queda aquí hasta
+    que el backend la confirma, así sobrevive a reinicios y caídas del
+    backend. Las que agotan OUTBOX_MAX_INTENTOS quedan como "fallido": sin
+    el token del usuario y sólo por OUTBOX_RETENCION_FALLIDOS.
+
+    Varios workers comparten el archivo: cada uno reserva las filas que va
+    a enviar ("enviando", con vencimiento) para que no las mande otro.
+
+    Cada POST es un "envío": las filas que lo forman se deciden la primera
+    vez que se reclaman y quedan guardadas, así cada reintento manda las
+    mismas filas con la misma Idempotency-Key.
+    """
+
+    def __init__(self, ruta: str):
+        self._lock = threading.Lock()
+        # FULL: una transacción aceptada no puede perderse con un corte de luz
+        self._conn = abrir_sqlite(ruta, synchronous="FULL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS outbox ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+            " token TEXT NOT NULL, data TEXT NOT NULL,"
+            " estado TEXT NOT NULL DEFAULT 'pendiente',"
+            " intentos INTEGER NOT NULL DEFAULT 0,"
+            " creado REAL NOT NULL, proximo_intento REAL NOT NULL,"
+            " ultimo_error TEXT, reserva REAL, lote TEXT, envio TEXT)"
+        )
+        columnas = {fila[1] for fila in self._conn.execute("PRAGMA table_info(outbox)")}
+        if "reserva" not in columnas:
+            self._conn.execute("ALTER TABLE outbox ADD COLUMN reserva REAL")
+        if "lote" not in columnas:
+            self._conn.execute("ALTER TABLE outbox ADD COLUMN lote TEXT")
+        if "envio" not in columnas:
+            self._conn.execute("ALTER TABLE outbox ADD COLUMN envio TEXT")
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS outbox_pendientes ON outbox(estado, proximo_intento)"
+        )
+        self.enviados = 0
+        self.errores_envio = 0
+        self.hay_trabajo = asyncio.Event()
+
+    def encolar(self, lote: list[dict], token: str, agrupar: bool = False) -> list[int]:
+        """agrupar: las filas comparten un id de lote y no se mezclan con otras al enviarse."""
+        ahora = time.time()
+        id_lote = uuid.uuid4().hex if agrupar else None
+        with self._lock, transaccion(self._conn):
+            ids = [
+                self._conn.execute(
+                    "INSERT INTO outbox (token, data, creado, proximo_intento, lote) VALUES (?, ?, ?, ?, ?)",
+                    (token, json.dumps(data), ahora, ahora, id_lote)
+                ).lastrowid
+                for data in lote
+            ]
+        return ids
+
+    def reclamar(self, limite: int) -> list[tuple[str, str, list[tuple[int, dict, int]]]]:
+        """
+        Reserva de forma atómica las filas vencidas (y las de reservas
+        vencidas) para este worker, siempre con su envío completo aunque
+        pase del límite, y las devuelve por envío: (envío, token, [(id, data, intentos)]).
+
+        Las filas que aún no tienen envío se agrupan por token y lote de
+        origen, de OUTBOX_TAMANO_LOTE en OUTBOX_TAMANO_LOTE.
+        """
+        ahora = time.time()
+        with self._lock, transaccion(self._conn):
+            filas = self._conn.execute(
+                "WITH vencidas AS ("
+                "  SELECT id, COALESCE(envio, lote) AS grupo FROM outbox"
+                "  WHERE (estado = 'pendiente' AND proximo_intento <= ?)"
+                "     OR (estado = 'enviando' AND reserva <= ?)),"
+                " primeras AS (SELECT id, grupo FROM vencidas ORDER BY id LIMIT ?)"
+                " UPDATE outbox SET estado = 'enviando', reserva = ?"
+                " WHERE id IN (SELECT id FROM primeras)"
+                "    OR id IN (SELECT id FROM vencidas WHERE grupo IN (SELECT grupo FROM primeras))"
+                " RETURNING id, token, data, intentos, lote, envio",
+                (ahora, ahora, limite, ahora + OUTBOX_RESERVA_SEGUNDOS)
+            ).fetchall()
+            filas.sort()
+
+            envios: dict[str, tuple[str, list]] = {}
+            abiertos: dict[tuple[str, str | None], str] = {}
+            asignados = []
+            for id_, token, data, intentos, lote, envio in filas:
+                if envio is None:
+                    envio = abiertos.get((token, lote))
+                    if envio is None or len(envios[envio][1]) >= max(OUTBOX_TAMANO_LOTE, 1):
+                        envio = abiertos[(token, lote)] = uuid.uuid4().hex
+                    asignados.append((envio, id_))
+                envios.setdefault(envio, (token, []))[1].append((id_, json.loads(data), intentos))
+
+            self._conn.executemany("UPDATE outbox SET envio = ? WHERE id = ?", asignados)
+
+        return [(envio, token, grupo) for envio, (token, grupo) in envios.items()]
+
+    def proximo_intento(self) -> float | None:
+        with self._lock:
+            fila = self._conn.execute(
+                "SELECT MIN(CASE estado WHEN 'pendiente' THEN proximo_intento ELSE reserva END)"
+                " FROM outbox WHERE estado IN ('pendiente', 'enviando')"
+            ).fetchone()
+        return fila[0]
+
+    def confirmar(self, ids: list[int]):
+        with self._lock:
+            self._conn.executemany("DELETE FROM outbox WHERE id = ?", [(i,) for i in ids])
+        self.enviados += len(ids)
+
+    def reintentar(self, ids: list[int], intentos: int, error: str, definitivo=False):
+        intentos += 1
+        espera = min(OUTBOX_BACKOFF_BASE * 2 ** (intentos - 1), OUTBOX_BACKOFF_MAX)
+        estado = "fallido" if definitivo or intentos >= OUTBOX_MAX_INTENTOS else "pendiente"
+        with self._lock:
+            # Una fila fallida ya no se envía: no hay por qué guardar la credencial
+            self._conn.executemany(
+                "UPDATE outbox SET estado = ?, intentos = ?, proximo_intento = ?, ultimo_error = ?,"
+                " reserva = NULL, token = CASE WHEN ? = 'fallido' THEN '' ELSE token END WHERE id = ?",
+                [(estado, intentos, time.time() + espera, error[:500], estado, i) for i in ids]
+            )
+        self.errores_envio += len(ids)
+
+    def purgar_fallidos(self):
+        """Borra las fallidas más viejas que OUTBOX_RETENCION_FALLIDOS (y quita tokens que hayan quedado)."""
+        with self._lock:
+            self._conn.execute(
+                "DELETE FROM outbox WHERE estado = 'fallido' AND proximo_intento < ?",
+                (time.time() - OUTBOX_RETENCION_FALLIDOS,)
+            )
+            self._conn.execute("UPDATE outbox SET token = '' WHERE estado = 'fallido' AND token != ''")
+
+    def estado(self) -> dict:
+        with self._lock:
+            pendientes, enviando, mas_antiguo = self._conn.execute(
+                "SELECT COUNT(*), COUNT(reserva), MIN(creado) FROM outbox"
+                " WHERE estado IN ('pendiente', 'enviando')"
+            ).fetchone()
+            fallidos = self._conn.execute(
+                "SELECT COUNT(*) FROM outbox WHERE estado = 'fallido'"
+            ).fetchone()[0]
+            ultimo_error = self._conn.execute(
+                "SELECT ultimo_error FROM outbox WHERE ultimo_error IS NOT NULL"
+                " ORDER BY proximo_intento DESC LIMIT 1"
+            ).fetchone()
+        return {
+            "pendientes": pendientes,
+            "enviando": enviando,
+            "antiguedad_pendiente_segundos": round(time.time() - mas_antiguo, 3) if mas_antiguo else 0.0,
+            "fallidos": fallidos,
+            "enviados": self.enviados,
+            "errores_envio": self.errores_envio,
+            "ultimo_error": ultimo_error[0] if ultimo_error else None
+        }
+
+    def cerrar(self):
+        with self._lock:
+            self._conn.close()
+
+
+# Se crea al arrancar la app (lifespan)
+outbox: Outbox | None = None
+
+
+async def encolar_transacciones(lote: list[dict], token: str, agrupar: bool = False):
+    """
+    Confirma las transacciones en la outbox local; el envío es en segundo
+    plano. Con agrupar van juntas en POST de hasta OUTBOX_TAMANO_LOTE.
+    """
+
+    if not BACKEND_URL:
+        log.warning("⚠ BACKEND_URL no configurado, no se encolan transacciones")
+        return
+
+    try:
+        with metricas.medir("encolar"):
+            await asyncio.to_thread(outbox.encolar, lote, token, agrupar)
+    except Exception as e:
+        log.error("❌ No se pudo guardar en la outbox: %s", e)
+        raise HTTPException(503, "No se pudo registrar la transacción, intenta de nuevo")
+
+    outbox.hay_trabajo.set()
+
+
+async def enviar_lote(envio: str, token: str, filas: list[tuple[int, dict, int]]):
+
+    ids = [fila[0] for fila in filas]
+    intentos = max(fila[2] for fila in filas)
+    cuerpo = filas[0][1] if len(filas) == 1 else [fila[1] for fila in filas]
+
+    try:
+        # La misma clave en cada reintento: el backend puede descartar duplicados
+        # (p. ej. si confirmó pero la respuesta se perdió por timeout)
+        headers = {
+            "Authorization": token,
+            "Content-Type": "application/json",
+            "Idempotency-Key": envio
+        }
+        with metricas.medir("envio_backend"):
+            res = await http_client.post(BACKEND_URL, json=cuerpo, headers=headers)
+
+    except Exception as e:
+        log.warning("⚠ Error enviando al backend: %s", e)
+        await asyncio.to_thread(outbox.reintentar, ids, intentos, repr(e))
+        return
+
+    if res.is_success:
+        await asyncio.to_thread(outbox.confirmar, ids)
+        return
 
-    return data
+    # 4xx (salvo 408/429) no se arregla reintentando
+    definitivo = res.is_client_error and res.status_code not in (408, 429)
+    error = f"HTTP {res.status_code}: {res.text[:200]}"
+    log.warning("⚠ Backend rechazó el envío: %s", error)
+    await asyncio.to_thread(outbox.reintentar, ids, intentos, error, definitivo)
+
+
+async def despachar_outbox():
+    """Tarea de fondo: envía lo vencido de la outbox con backoff exponencial."""
+
+    siguiente_purga = 0.0
+
+    while True:
+        try:
+            if time.monotonic() >= siguiente_purga:
+                await asyncio.to_thread(outbox.purgar_fallidos)
+                siguiente_purga = time.monotonic() + 3600
+
+            envios = await asyncio.to_thread(outbox.reclamar, max(100, LOTE_MAX_MENSAJES))
+
+            if envios:
+                await asyncio.gather(*(enviar_lote(envio, token, filas) for envio, token, filas in envios))
+                continue
+
+            proximo = await asyncio.to_thread(outbox.proximo_intento)
+            espera = 1.0 if proximo is None else min(max(proximo - time.time(), 0.05), 1.0)
+
+            outbox.hay_trabajo.clear()
+            try:
+                await asyncio.wait_for(outbox.hay_trabajo.wait(), timeout=espera)
+            except asyncio.TimeoutError:
+                pass
+
+        except asyncio.CancelledError:
+            raise
+
+        except Exception as e:
+            log.error("⚠ Error en el despachador de la outbox: %s", e)
+            await asyncio.sleep(1)
+
+
+# =====================================================
+# 🔥 FUNCIÓN PRINCIPAL
+# =====================================================
+def construir_transaccion(mensaje: str, monto: float, analisis: dict, ahora: datetime) -> dict:
+
+    # ❶ SI HAY GROCERÍAS → BLOQUEA
+    if analisis["ofensivo"]:
+        raise HTTPException(400, "El mensaje contiene lenguaje ofensivo")
+
+    # ❷ SI HAY DOBLE SENTIDO → ADVIERTE PERO **SÍ GUARDA**
+    advertencia = ADVERTENCIA_DOBLE_SENTIDO if analisis["doble_sentido"] else None
+
+    return {
+        "type": analisis["type"],
+        "amount": monto,
+        "category": analisis["categoria"],
+        "descripcion": mensaje.capitalize(),
+        "date": ahora.strftime("%Y-%m-%dT%H:%M:%S"),
+        "advertencia": advertencia
+    }
+
+
+async def clasificar_gasto(
+    mensaje: str, token: str, monto: float | None = None, fecha: datetime | None = None, tipo: str | None = None
+):
+    """
+    En las importaciones el monto y la fecha llegan en sus propias columnas
+    (y el signo del monto puede decidir el tipo); si no, el monto se extrae
+    del mensaje y la fecha es la actual.
+    """
+
+    ahora = fecha or datetime.now()
+
+    if monto is None:
+        try:
+            with metricas.medir("monto"):
+                monto = extraer_monto(mensaje)
+        except HTTPException:
+            # Sin monto no hace falta clasificar; sólo se conserva la
+            # prioridad del filtro ofensivo sobre el error de monto
+            ofensivo, confianza = detectar_groserias_local(normalizar_mensaje(mensaje))
+            if confianza < UMBRAL_CONFIANZA_LOCAL:
+                try:
+                    ofensivo = await contiene_groserias_IA(mensaje)
+                except Exception as e:
+                    registrar_respaldo("ofensivo", e)
+            if ofensivo:
+                raise HTTPException(400, "El mensaje contiene lenguaje ofensivo")
+            raise
+
+    indice, (conocida,), categorias = await buscar_en_indice(token, [mensaje])
+    usuario = indice.usuario if categorias else None
+    analisis = await analizar_mensaje(mensaje, conocida, tipo, None if conocida else categorias, usuario)
+    analisis = aplicar_indice_usuario(indice, mensaje, analisis, conocida)
+    data = construir_transaccion(mensaje, monto, analisis, ahora)
+
+    log.debug("📤 ENCOLANDO: %s", data)
+
+    await encolar_transacciones([data], token)
+
+    # "degradado" sólo va en la respuesta: el backend recibe la transacción tal cual
+    return {**data, "degradado": analisis.get("degradado", False)}
+
+
+async def clasificar_gastos(mensajes: list[str], token: str) -> list[dict]:
+    """
+    Versión en lote de clasificar_gasto: los errores se reportan por
+    elemento y las transacciones válidas se encolan juntas.
+    """
+
+    ahora = datetime.now()
+    indice, conocidas, categorias = await buscar_en_indice(token, mensajes)
+    usuario = indice.usuario if categorias else None
+    resultados = [{"indice": i, "resultado": None, "error": None} for i in range(len(mensajes))]
+    montos: list[float | None] = [None] * len(mensajes)
+    # Por qué no hay monto ("No se encontró monto", "Monto inválido"), como en clasificar_gasto
+    errores_monto: list[str | None] = [None] * len(mensajes)
+    analisis: list[dict | None] = [None] * len(mensajes)
+
+    for i, mensaje in enumerate(mensajes):
+        try:
+            montos[i] = extraer_monto(mensaje)
+        except HTTPException as e:
+            errores_monto[i] = e.detail
+            # Sin monto sólo importa si además es ofensivo (tiene prioridad)
+            ofensivo, confianza = detectar_groserias_local(normalizar_mensaje(mensaje))
+            if ofensivo or confianza >= UMBRAL_CONFIANZA_LOCAL:
+                resultados[i]["error"] = "El mensaje contiene lenguaje ofensivo" if ofensivo else e.detail
+            continue
+
+        analisis[i] = await analizar_sin_red(mensaje, conocidas[i], usuario=usuario)
+
+    # Todo lo que no resolvieron los niveles locales va a Groq en lotes
+    pendientes = [
+        i for i in range(len(mensajes))
+        if analisis[i] is None and resultados[i]["error"] is None
+    ]
+    if pendientes:
+        analizados = await analizar_lote_con_groq(
+            [mensajes[i] for i in pendientes], [conocidas[i] for i in pendientes], categorias, usuario
+        )
+        for i, resultado in zip(pendientes, analizados):
+            analisis[i] = resultado
+
+    lote = []
+    for i, mensaje in enumerate(mensajes):
+        if resultados[i]["error"] is not None:
+            continue
+
+        if montos[i] is None:
+            ofensivo = analisis[i]["ofensivo"]
+            resultados[i]["error"] = "El mensaje contiene lenguaje ofensivo" if ofensivo else errores_monto[i]
+            continue
+
+        analisis[i] = aplicar_indice_usuario(indice, mensaje, analisis[i], conocidas[i])
+
+        try:
+            data = construir_transaccion(mensaje, montos[i], analisis[i], ahora)
+        except HTTPException as e:
+            resultados[i]["error"] = e.detail
+            continue
+
+        resultados[i]["resultado"] = {**data, "degradado": analisis[i].get("degradado", False)}
+        lote.append(data)
+
+    if lote:
+        log.debug("📤 ENCOLANDO LOTE: %s transacciones", len(lote))
+        await encolar_transacciones(lote, token, agrupar=True)
+
+    return resultados
+
+
+# =====================================================
+# 🔥 IMPORTACIÓN DE ESTADOS DE CUENTA (STREAMING)
+# =====================================================
+FORMATOS_IMPORTACION = {
+    "text/csv": "csv",
+    "application/csv": "csv",
+    "application/x-ndjson": "ndjson",
+    "application/ndjson": "ndjson",
+    "application/jsonl": "ndjson"
+}
+
+# Importaciones en curso, para consultar progreso o cancelarlas
+importaciones: dict[str, dict] = {}
+
+
+class RespuestaNDJSON(StreamingResponse):
+    """
+    StreamingResponse sin su propio listen_for_disconnect: aquí el cuerpo
+    de la petición se sigue leyendo mientras se responde, y dos lectores de
+    receive() se robarían los fragmentos. La desconexión la detecta
+    procesar_importacion.
+    """
+
+    media_type = "application/x-ndjson"
+
+    async def __call__(self, scope, receive, send):
+        await self.stream_response(send)
+
+
+async def leer_lineas(request: Request):
+    """Decodifica el cuerpo por fragmentos y entrega línea por línea."""
+
+    decodificador = codecs.getincrementaldecoder("utf-8-sig")(errors="replace")
+    pendiente = ""
+
+    async for fragmento in request.stream():
+        pendiente += decodificador.decode(fragmento)
+        *lineas, pendiente = pendiente.split("\n")
+        for linea in lineas:
+            yield linea.rstrip("\r")
+
+    pendiente += decodificador.decode(b"", final=True)
+    if pendiente:
+        yield pendiente.rstrip("\r")
+
+
+async def leer_registros_csv(lineas):
+    """Une las líneas de un mismo registro cuando un campo entrecomillado trae saltos."""
+
+    registro = ""
+    async for linea in lineas:
+        registro = f"{registro}\n{linea}" if registro else linea
+        if registro.count('"') % 2:
+            continue
+
+        if registro.strip():
+            yield next(csv.reader([registro]))
+        registro = ""
+
+    if registro.strip():
+        yield next(csv.reader([registro]))
+
+
+FORMATOS_FECHA = ("%Y-%m-%d", "%Y-%m-%dT%H:%M:%S", "%Y-%m-%d %H:%M:%S", "%d/%m/%Y", "%d-%m-%Y", "%d/%m/%y")
+
+
+def leer_fecha_celda(texto: str) -> datetime:
+    """Fecha de operación del estado de cuenta (ISO o día/mes/año)."""
+    texto = texto.strip()
+    for formato in FORMATOS_FECHA:
+        try:
+            return datetime.strptime(texto, formato)
+        except ValueError:
+            pass
+    raise HTTPException(400, f"Fecha inválida: {texto!r}")
+
+
+def armar_fila(mensaje: str, monto: str | float | None, fecha: str | None) -> dict:
+    """Fila lista para clasificar_gasto; lanza HTTPException si monto o fecha no se entienden."""
+    tipo = None
+    if isinstance(monto, str):
+        monto, tipo = leer_monto_celda(monto)
+    elif monto is not None:
+        # Igual que en la columna CSV: los cargos pueden venir en negativo
+        monto, tipo = abs(monto), tipo_por_signo(monto < 0, False)
+        if not monto:
+            raise HTTPException(400, "Monto inválido")
+
+    return {
+        "mensaje": mensaje,
+        "monto": monto,
+        "tipo": tipo,
+        "fecha": leer_fecha_celda(fecha) if fecha else None
+    }
+
+
+async def filas_csv(registros, encabezado: list[str], columna_mensaje: str, columna_monto: str | None, columna_fecha: str | None):
+
+    indice_mensaje = encabezado.index(columna_mensaje)
+    indice_monto = encabezado.index(columna_monto) if columna_monto else None
+    indice_fecha = encabezado.index(columna_fecha) if columna_fecha else None
+
+    def celda(celdas: list[str], indice: int | None) -> str | None:
+        if indice is None:
+            return None
+        if indice >= len(celdas):
+            raise HTTPException(400, f"Fila sin columna {encabezado[indice]!r}")
+        return celdas[indice]
+
+    async for celdas in registros:
+        try:
+            # El monto se lee de su columna, no del texto: la descripción puede traer números
+            yield armar_fila(celda(celdas, indice_mensaje), celda(celdas, indice_monto), celda(celdas, indice_fecha)), None
+        except HTTPException as e:
+            yield None, e.detail
+
+
+async def filas_ndjson(lineas):
+
+    async for linea in lineas:
+        if not linea.strip():
+            continue
+
+        try:
+            fila = FilaImportacion.model_validate_json(linea)
+            yield armar_fila(fila.mensaje, fila.monto, fila.fecha), None
+        except ValidationError:
+            yield None, "Línea NDJSON inválida: se espera {\"mensaje\": \"...\"} (monto y fecha opcionales)"
+        except HTTPException as e:
+            yield None, e.detail
+
+
+async def procesar_importacion(request: Request, filas, token: str, importacion: dict):
+    """
+    Lector → cola acotada → IMPORTACION_CONCURRENCIA trabajadores → cola
+    acotada → respuesta NDJSON. Si el cliente lee lento o Groq tarda, las
+    colas se llenan y se deja de leer el cuerpo: la memoria no crece con
+    el tamaño del archivo.
+    """
+
+    entrada = asyncio.Queue(maxsize=IMPORTACION_CONCURRENCIA * 2)
+    salida = asyncio.Queue(maxsize=IMPORTACION_CONCURRENCIA * 2)
+    cancelada = importacion["cancelada"]
+
+    async def lector():
+        try:
+            indice = 0
+            async for fila, error in filas:
+                if cancelada.is_set():
+                    break
+                await entrada.put((indice, fila, error))
+                importacion["leidas"] += 1
+                indice += 1
+
+        except Exception as e:
+            log.warning("⚠ Error leyendo la importación: %s", e)
+            importacion["error"] = str(e)
+            cancelada.set()
+
+        # Fuera de un finally: si al lector lo cancelan (el cliente cerró la
+        # respuesta), los trabajadores ya no leen la cola y esto no terminaría
+        for _ in range(IMPORTACION_CONCURRENCIA):
+            await entrada.put(None)
+
+        # Leído el cuerpo, lo siguiente que llega por receive() es la desconexión
+        while not cancelada.is_set():
+            mensaje = await request.receive()
+            if mensaje["type"] == "http.disconnect":
+                log.info("⚠ Cliente desconectado, se cancela la importación %s", importacion["id"])
+                cancelada.set()
+
+    async def trabajador():
+        while True:
+            fila = await entrada.get()
+            if fila is None:
+                await salida.put(None)
+                return
+
+            indice, fila, error = fila
+            if cancelada.is_set():
+                continue
+
+            resultado = {"indice": indice, "resultado": None, "error": error}
+            if error is None:
+                try:
+                    resultado["resultado"] = await clasificar_gasto(fila["mensaje"], token, fila["monto"], fila["fecha"], fila["tipo"])
+                except HTTPException as e:
+                    resultado["error"] = e.detail
+                except Exception as e:
+                    resultado["error"] = f"Error interno: {e}"
+
+            importacion["procesadas"] += 1
+            if resultado["error"] is None:
+                importacion["clasificadas"] += 1
+            else:
+                importacion["errores"] += 1
+
+            await salida.put(resultado)
+
+    tareas = [asyncio.create_task(lector())]
+    tareas += [asyncio.create_task(trabajador()) for _ in range(IMPORTACION_CONCURRENCIA)]
+
+    try:
+        terminados = 0
+        while terminados < IMPORTACION_CONCURRENCIA:
+            resultado = await salida.get()
+            if resultado is None:
+                terminados += 1
+                continue
+            yield json.dumps(resultado, ensure_ascii=False) + "\n"
+
+        yield json.dumps({"resumen": progreso_importacion(importacion)}, ensure_ascii=False) + "\n"
+
+    finally:
+        # Termina normal, por cancelación o porque el cliente se desconectó
+        cancelar_tareas(*tareas)
+        importaciones.pop(importacion["id"], None)
+        # Desde que llegó la petición hasta la última línea (o la desconexión)
+        metricas.observar("ia_etapa_duracion_segundos", time.monotonic() - importacion["inicio"], etapa="total_importacion")
+
+
+def progreso_importacion(importacion: dict) -> dict:
+    return {
+        "id": importacion["id"],
+        "leidas": importacion["leidas"],
+        "procesadas": importacion["procesadas"],
+        "clasificadas": importacion["clasificadas"],
+        "errores": importacion["errores"],
+        "cancelada": importacion["cancelada"].is_set(),
+        "error": importacion["error"],
+        "segundos": round(time.monotonic() - importacion["inicio"], 3)
+    }
 
 
 # =====================================================
@@ -280,16 +2850,185 @@ async def clasificar_endpoint(payload: MensajeUsuario, authorization: str = Head
     if not authorization.startswith("Bearer "):
         raise HTTPException(401, "Token inválido")
 
-    # ❶ SI HAY GROCERÍAS → BLOQUEA
-    if contiene_groserias_IA(payload.mensaje):
-        raise HTTPException(400, "El mensaje contiene lenguaje ofensivo")
+    with metricas.medir("total"):
+        return await clasificar_gasto(payload.mensaje, authorization)
+
+
+@app.post("/clasificar_gastos", response_model=list[ResultadoLote])
+async def clasificar_lote_endpoint(payload: list[MensajeUsuario], authorization: str = Header(...)):
+
+    if not authorization.startswith("Bearer "):
+        raise HTTPException(401, "Token inválido")
+
+    if len(payload) > LOTE_MAX_MENSAJES:
+        raise HTTPException(413, f"Máximo {LOTE_MAX_MENSAJES} mensajes por lote")
+
+    with metricas.medir("total_lote"):
+        return await clasificar_gastos([p.mensaje for p in payload], authorization)
+
+
+@app.post("/importar_estado_cuenta")
+async def importar_estado_cuenta(
+    request: Request,
+    authorization: str = Header(...),
+    formato: str | None = None,
+    columna_mensaje: str = "mensaje",
+    columna_monto: str | None = None,
+    columna_fecha: str | None = None
+):
+    """
+    Recibe un CSV (con encabezado) o NDJSON ({"mensaje": ...} por línea) y
+    devuelve NDJSON con un resultado por fila conforme se van clasificando.
+    Con columna_monto / columna_fecha (o "monto" / "fecha" en NDJSON) se usan
+    esos valores en vez de extraer el monto del texto y fechar con la hora actual.
+    Un monto negativo (cargo) es gasto y uno con "+" (abono), ingreso, sin preguntarle a Groq.
+    """
+
+    if not authorization.startswith("Bearer "):
+        raise HTTPException(401, "Token inválido")
+
+    tipo_contenido = request.headers.get("content-type", "").split(";")[0].strip().lower()
+    formato = (formato or FORMATOS_IMPORTACION.get(tipo_contenido, "")).lower()
+    if formato not in ("csv", "ndjson"):
+        raise HTTPException(415, "Formato no soportado: usa text/csv o application/x-ndjson")
+
+    lineas = leer_lineas(request)
+
+    if formato == "csv":
+        # El encabezado se lee antes de responder para validar las columnas
+        registros = leer_registros_csv(lineas)
+        try:
+            encabezado = [c.strip().lower() for c in await anext(registros)]
+        except StopAsyncIteration:
+            raise HTTPException(400, "El CSV está vacío")
+
+        columna_mensaje = columna_mensaje.strip().lower()
+        columna_monto = columna_monto.strip().lower() if columna_monto else None
+        columna_fecha = columna_fecha.strip().lower() if columna_fecha else None
+        faltantes = [c for c in (columna_mensaje, columna_monto, columna_fecha) if c and c not in encabezado]
+        if faltantes:
+            raise HTTPException(400, f"Columnas no encontradas: {faltantes}. Disponibles: {encabezado}")
+
+        filas = filas_csv(registros, encabezado, columna_mensaje, columna_monto, columna_fecha)
+    else:
+        filas = filas_ndjson(lineas)
+
+    importacion = {
+        "id": uuid.uuid4().hex,
+        # Hash del token de quien la subió: sólo él puede consultarla o cancelarla
+        "usuario": usuario_de_token(authorization),
+        "leidas": 0,
+        "procesadas": 0,
+        "clasificadas": 0,
+        "errores": 0,
+        "error": None,
+        "cancelada": asyncio.Event(),
+        "inicio": time.monotonic()
+    }
+    importaciones[importacion["id"]] = importacion
+
+    return RespuestaNDJSON(
+        procesar_importacion(request, filas, authorization, importacion),
+        headers={"X-Importacion-Id": importacion["id"]}
+    )
+
+
+def importacion_del_usuario(importacion_id: str, authorization: str) -> dict:
+    # La de otro usuario responde igual que una inexistente: no revela que existe
+    importacion = importaciones.get(importacion_id)
+    if not importacion or not hmac.compare_digest(importacion["usuario"], usuario_de_token(authorization)):
+        raise HTTPException(404, "Importación no encontrada o ya terminada")
+    return importacion
+
+
+@app.get("/importaciones/{importacion_id}")
+async def importacion_progreso(importacion_id: str, authorization: str = Header(...)):
+    return progreso_importacion(importacion_del_usuario(importacion_id, authorization))
+
+
+@app.delete("/importaciones/{importacion_id}")
+async def importacion_cancelar(importacion_id: str, authorization: str = Header(...)):
+    importacion = importacion_del_usuario(importacion_id, authorization)
+    importacion["cancelada"].set()
+    return progreso_importacion(importacion)
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+
+    extras = []
+
+    def agregar(nombre, ayuda, valor, tipo="gauge", **etiquetas):
+        extras.append((nombre, tipo, ayuda, etiquetas, valor))
+
+    for nivel, n in niveles_resueltos.items():
+        agregar("ia_niveles_resueltos_total", "Análisis resueltos por cada nivel de la cascada", n, "counter", nivel=nivel)
+
+    estado_cache = await asyncio.to_thread(cache.estadisticas)
+    agregar("ia_cache_aciertos_total", "Aciertos de la caché de resultados", estado_cache["aciertos"], "counter", backend=estado_cache["backend"])
+    agregar("ia_cache_fallos_total", "Fallos de la caché de resultados", estado_cache["fallos"], "counter", backend=estado_cache["backend"])
+    agregar("ia_cache_entradas", "Entradas en la caché de resultados", estado_cache["entradas"], backend=estado_cache["backend"])
+
+    agregar("ia_indice_categorias_aciertos_total", "Mensajes cuya categoría salió del índice del usuario", indice_categorias.aciertos, "counter")
+    agregar("ia_indice_categorias_ajustadas_total", "Categorías nuevas unidas a una existente del usuario", indice_categorias.ajustadas, "counter")
+
+    for evento, n in estadisticas_groq.items():
+        agregar("groq_eventos_total", "Llamadas, deduplicaciones, errores y respaldos de la capa de Groq", n, "counter", evento=evento)
+    agregar("groq_circuito_abierto", "1 si el circuito de Groq no está cerrado", int(circuito_groq.estado != "cerrado"))
+    agregar("groq_limite_rpm", "Tasa actual del limitador adaptativo", limitador_groq.tasa * 60)
+
+    if outbox:
+        estado_outbox = await asyncio.to_thread(outbox.estado)
+        agregar("outbox_pendientes", "Transacciones pendientes de enviar al backend", estado_outbox["pendientes"])
+        agregar("outbox_fallidos", "Transacciones que agotaron los reintentos", estado_outbox["fallidos"])
+        agregar("outbox_antiguedad_segundos", "Antigüedad de la transacción pendiente más vieja", estado_outbox["antiguedad_pendiente_segundos"])
+        agregar("outbox_enviados_total", "Transacciones confirmadas por el backend", estado_outbox["enviados"], "counter")
+
+    return PlainTextResponse(metricas.exportar(extras), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/groq/estado")
+async def groq_estado():
+    return {
+        "configurado": client is not None,
+        "circuito": circuito_groq.estado,
+        "fallos_consecutivos": circuito_groq.fallos,
+        "limitador": limitador_groq.estado(),
+        "en_vuelo": len(vuelos_groq),
+        **estadisticas_groq
+    }
+
+
+@app.get("/cache/estadisticas")
+async def cache_estadisticas():
+    return await asyncio.to_thread(cache.estadisticas)
+
+
+@app.get("/clasificador/estadisticas")
+async def clasificador_estadisticas():
+    total = sum(niveles_resueltos.values())
+    return {
+        "umbral_confianza_local": UMBRAL_CONFIANZA_LOCAL,
+        "confianza_local_no_ofensivo": CONFIANZA_LOCAL_NO_OFENSIVO,
+        "total": total,
+        "niveles": niveles_resueltos,
+        "fracciones": {
+            nivel: round(n / total, 4) if total else 0.0
+            for nivel, n in niveles_resueltos.items()
+        }
+    }
+
+
+@app.get("/categorias/estadisticas")
+async def categorias_estadisticas():
+    return await asyncio.to_thread(indice_categorias.estadisticas)
 
-    # ❷ SI HAY DOBLE SENTIDO → ADVIERTE PERO **SÍ GUARDA**
-    advertencia = None
-    if contiene_doble_sentido_IA(payload.mensaje):
-        advertencia = "El mensaje contiene doble sentido. Por favor, exprésate con claridad."
 
-    return clasificar_gasto(payload.mensaje, authorization, advertencia)
+@app.get("/outbox/estado")
+async def outbox_estado():
+    if not outbox:
+        raise HTTPException(503, "Outbox no inicializada")
+    return await asyncio.to_thread(outbox.estado)
 
 
 @app.get("/")
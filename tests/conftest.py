@@ -0,0 +1,65 @@
+import asyncio
+
+import pytest
+
+import main
+
+
+@pytest.fixture
+def reloj(monkeypatch):
+    """time.monotonic controlado por el test."""
+    ahora = [1000.0]
+    monkeypatch.setattr(main.time, "monotonic", lambda: ahora[0])
+    return ahora
+
+
+class GroqFalso:
+    """
+    Reemplazo de llamar_groq. `respuestas` dice qué devuelve cada etapa: el texto,
+    una excepción que lanzar o una función de la etapa que devuelve o lanza.
+    `esperas` retrasa etapas para ver el orden y las cancelaciones.
+    """
+
+    def __init__(self):
+        self.respuestas = {
+            "ofensivo": '{"ofensivo": false}',
+            "doble_sentido": '{"doble_sentido": false}',
+            "tipo": '{"type": "expense"}',
+            "categoria": '{"categoria": "Transporte"}'
+        }
+        self.esperas: dict[str, float] = {}
+        self.llamadas: list[str] = []
+        self.prompts: dict[str, str] = {}
+        self.canceladas: list[str] = []
+        self.en_vuelo = 0
+        self.max_en_vuelo = 0
+
+    async def __call__(self, prompt, etapa, **kwargs):
+        self.llamadas.append(etapa)
+        self.prompts[etapa] = prompt
+        self.en_vuelo += 1
+        self.max_en_vuelo = max(self.max_en_vuelo, self.en_vuelo)
+        try:
+            await asyncio.sleep(self.esperas.get(etapa, 0))
+        except asyncio.CancelledError:
+            self.canceladas.append(etapa)
+            raise
+        finally:
+            self.en_vuelo -= 1
+
+        respuesta = self.respuestas[etapa]
+        if callable(respuesta):
+            respuesta = respuesta(etapa)
+        if isinstance(respuesta, Exception):
+            raise respuesta
+        return respuesta
+
+
+@pytest.fixture
+def groq(monkeypatch):
+    """Groq falso en modo separado y con una caché vacía para el test."""
+    falso = GroqFalso()
+    monkeypatch.setattr(main, "MODO_CLASIFICACION", "separado")
+    monkeypatch.setattr(main, "cache", main.CacheMemoria(10, 60))
+    monkeypatch.setattr(main, "llamar_groq", falso)
+    return falso
@@ -0,0 +1,92 @@
+import asyncio
+import json
+
+import pytest
+from pydantic import ValidationError
+
+import main
+
+# Ningún léxico lo explica: sin Groq no se resuelve local
+MENSAJE = "pague 80 en la tlapaleria"
+FUSIONADO = {"ofensivo": False, "doble_sentido": False, "type": "expense", "categoria": "Hogar"}
+
+
+# ---------- Modo fusionado ----------
+
+def test_fusionado_valido_es_una_sola_consulta(groq):
+    groq.respuestas["fusionado"] = json.dumps(FUSIONADO)
+
+    analisis = asyncio.run(main.analizar_fusionado(MENSAJE))
+
+    assert analisis == {**FUSIONADO, "degradado": False}
+    assert groq.llamadas == ["fusionado"]
+
+
+@pytest.mark.parametrize("cambio", [
+    {"ofensivo": "false"},
+    {"doble_sentido": 0},
+    {"type": "gasto"},
+    {"categoria": "   "},
+    {"categoria": "x" * 41},
+    {"extra": True},
+])
+def test_el_esquema_fusionado_es_estricto(groq, cambio):
+    groq.respuestas["fusionado"] = json.dumps({**FUSIONADO, **cambio})
+
+    with pytest.raises(ValidationError):
+        asyncio.run(main.clasificar_fusionado_IA(MENSAJE))
+
+
+@pytest.mark.parametrize("respuesta", ["no es json", json.dumps({**FUSIONADO, "ofensivo": "false"})])
+def test_fusionado_invalido_se_pregunta_campo_por_campo(groq, respuesta):
+    groq.respuestas["fusionado"] = respuesta
+
+    analisis = asyncio.run(main.analizar_fusionado(MENSAJE))
+
+    assert groq.llamadas[0] == "fusionado"
+    assert sorted(groq.llamadas[1:]) == ["categoria", "doble_sentido", "ofensivo", "tipo"]
+    assert (analisis["categoria"], analisis["degradado"]) == ("Transporte", False)
+
+
+def test_fusionado_sin_groq_usa_el_respaldo_local_sin_mas_llamadas(groq):
+    groq.respuestas["fusionado"] = main.GroqNoDisponible("circuito abierto")
+
+    analisis = asyncio.run(main.analizar_fusionado(MENSAJE))
+
+    assert groq.llamadas == ["fusionado"]
+    assert (analisis["categoria"], analisis["degradado"]) == ("SinCategoria", True)
+
+
+# ---------- Modo separado ----------
+
+def test_las_cuatro_consultas_separadas_van_a_la_vez(groq):
+    groq.esperas = dict.fromkeys(["ofensivo", "doble_sentido", "tipo", "categoria"], 0.05)
+
+    analisis = asyncio.run(main.analizar_separado(MENSAJE))
+
+    assert sorted(groq.llamadas) == ["categoria", "doble_sentido", "ofensivo", "tipo"]
+    assert groq.max_en_vuelo == 4
+    assert (analisis["categoria"], analisis["degradado"]) == ("Transporte", False)
+
+
+def test_si_es_ofensivo_se_cancelan_las_demas_consultas(groq):
+    groq.respuestas["ofensivo"] = '{"ofensivo": true}'
+    groq.esperas = dict.fromkeys(["doble_sentido", "tipo", "categoria"], 5)
+
+    async def analizar_y_ver_canceladas():
+        analisis = await main.analizar_separado(MENSAJE)
+        # Antes de que asyncio.run cancele lo que quede al cerrar el loop
+        await asyncio.sleep(0)
+        return analisis, sorted(groq.canceladas)
+
+    analisis, canceladas = asyncio.run(asyncio.wait_for(analizar_y_ver_canceladas(), 1))
+
+    assert analisis["ofensivo"] is True
+    assert canceladas == ["categoria", "doble_sentido", "tipo"]
+
+
+def test_lo_que_ya_se_sabe_no_se_le_pregunta_a_groq(groq):
+    analisis = asyncio.run(main.analizar_separado(MENSAJE, "Hogar", "income"))
+
+    assert sorted(groq.llamadas) == ["doble_sentido", "ofensivo"]
+    assert (analisis["categoria"], analisis["type"]) == ("Hogar", "income")
@@ -0,0 +1,82 @@
+import asyncio
+
+import pytest
+
+import main
+
+
+def obtener(cache: main.CacheResultados, clave: str) -> dict | None:
+    return asyncio.run(cache.obtener(clave))
+
+
+def test_memoria_no_pasa_del_maximo_y_saca_la_menos_usada(reloj):
+    cache = main.CacheMemoria(max_entradas=2, ttl=60)
+    cache.guardar("a", {"v": 1})
+    cache.guardar("b", {"v": 2})
+
+    # Leer "a" la vuelve la más reciente: al entrar "c" sale "b"
+    assert obtener(cache, "a") == {"v": 1}
+    cache.guardar("c", {"v": 3})
+
+    assert cache.estadisticas()["entradas"] == 2
+    assert obtener(cache, "b") is None
+    assert obtener(cache, "a") == {"v": 1}
+    assert obtener(cache, "c") == {"v": 3}
+
+
+def test_memoria_reescribir_una_clave_no_cuenta_como_otra_entrada(reloj):
+    cache = main.CacheMemoria(max_entradas=2, ttl=60)
+    cache.guardar("a", {"v": 1})
+    cache.guardar("b", {"v": 2})
+    cache.guardar("a", {"v": 10})
+
+    assert cache.estadisticas()["entradas"] == 2
+    assert obtener(cache, "a") == {"v": 10}
+    assert obtener(cache, "b") == {"v": 2}
+
+
+def test_memoria_expira_tras_el_ttl(reloj):
+    cache = main.CacheMemoria(max_entradas=10, ttl=60)
+    cache.guardar("a", {"v": 1})
+
+    reloj[0] += 59
+    assert obtener(cache, "a") == {"v": 1}
+
+    # Un acierto no renueva el TTL
+    reloj[0] += 2
+    assert obtener(cache, "a") is None
+    assert cache.estadisticas()["entradas"] == 0
+
+    estadisticas = cache.estadisticas()
+    assert (estadisticas["aciertos"], estadisticas["fallos"]) == (1, 1)
+
+
+def test_sqlite_lo_pendiente_se_lee_antes_de_escribirse_y_sobrevive_al_cerrar(tmp_path):
+    ruta = str(tmp_path / "cache.db")
+
+    async def guardar_y_leer():
+        cache = main.CacheSQLite(10, 60, ruta)
+        cache.guardar("a", {"v": 1})
+        leido = await cache.obtener("a")
+        cache.cerrar()
+        return leido
+
+    assert asyncio.run(guardar_y_leer()) == {"v": 1}
+
+    async def releer():
+        cache = main.CacheSQLite(10, 60, ruta)
+        try:
+            return await cache.obtener("a")
+        finally:
+            cache.cerrar()
+
+    assert asyncio.run(releer()) == {"v": 1}
+
+
+def test_un_escritor_sin_sus_ganchos_falla_al_crearse(tmp_path):
+    class SinEscritura(main.EscritorSQLite):
+        def _tomar_pendientes(self):
+            return []
+
+    with pytest.raises(TypeError):
+        SinEscritura(str(tmp_path / "x.db"))
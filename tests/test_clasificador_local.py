@@ -0,0 +1,36 @@
+import pytest
+
+import main
+
+
+def resuelve_local(mensaje: str) -> bool:
+    _, confianza = main.clasificador_local(mensaje)
+    return confianza >= main.UMBRAL_CONFIANZA_LOCAL
+
+
+@pytest.mark.parametrize("mensaje", [
+    "pague 50 de uber",
+    "Pagué $300 de tacos.",
+    "gaste 200 en farmacia",
+    "me pagaron la quincena 5000",
+])
+def test_mensaje_explicado_por_lexicos_no_consulta_groq(mensaje):
+    assert resuelve_local(mensaje)
+
+
+@pytest.mark.parametrize("mensaje", [
+    "pagué 300 de tacos con la perra de mi jefa",
+    "pagué 500 de uber al hijo de su madre del chofer",
+    "pague 50 de uber al baboso del chofer",
+])
+def test_palabras_fuera_de_los_lexicos_pasan_por_el_filtro_de_groq(mensaje):
+    ofensivo, confianza = main.detectar_groserias_local(main.normalizar_mensaje(mensaje))
+    assert not ofensivo
+    assert confianza < main.UMBRAL_CONFIANZA_LOCAL
+    assert not resuelve_local(mensaje)
+
+
+def test_groseria_de_la_lista_se_resuelve_local():
+    analisis, confianza = main.clasificador_local("pague 50 de uber, que chinga")
+    assert analisis["ofensivo"]
+    assert confianza == 1.0
@@ -0,0 +1,209 @@
+import asyncio
+
+import pytest
+
+import main
+
+
+@pytest.fixture
+def groq_falso(monkeypatch):
+    """
+    Reemplaza la llamada HTTP a Groq: cada llamada espera a que el test
+    suelte `listo` y responde "ok". Devuelve (llamadas, listo).
+    """
+    llamadas = []
+    listo = asyncio.Event()
+
+    async def falso(kwargs, etapa):
+        llamadas.append(kwargs["messages"][0]["content"])
+        await listo.wait()
+        return "ok"
+
+    monkeypatch.setattr(main, "_llamar_groq", falso)
+    monkeypatch.setattr(main, "vuelos_groq", {})
+    return llamadas, listo
+
+
+# ---------- Llamadas compartidas (singleflight) ----------
+
+def test_prompts_identicos_en_vuelo_comparten_una_llamada(groq_falso):
+    llamadas, listo = groq_falso
+
+    async def dos_interesados():
+        a = asyncio.create_task(main.llamar_groq("hola", "tipo"))
+        b = asyncio.create_task(main.llamar_groq("hola", "tipo"))
+        await asyncio.sleep(0)
+        listo.set()
+        return await asyncio.gather(a, b)
+
+    assert asyncio.run(dos_interesados()) == ["ok", "ok"]
+    assert llamadas == ["hola"]
+    assert main.vuelos_groq == {}
+
+
+def test_cancelar_a_un_interesado_no_cancela_la_llamada_de_los_demas(groq_falso):
+    llamadas, listo = groq_falso
+
+    async def uno_se_va():
+        a = asyncio.create_task(main.llamar_groq("hola", "tipo"))
+        b = asyncio.create_task(main.llamar_groq("hola", "tipo"))
+        await asyncio.sleep(0)
+        a.cancel()
+        await asyncio.sleep(0)
+        listo.set()
+        return await b, a.cancelled()
+
+    assert asyncio.run(uno_se_va()) == ("ok", True)
+    assert llamadas == ["hola"]
+
+
+def test_si_se_van_todos_la_llamada_se_cancela_y_no_la_hereda_uno_nuevo(groq_falso):
+    llamadas, listo = groq_falso
+
+    async def se_van_todos_y_llega_otro():
+        a = asyncio.create_task(main.llamar_groq("hola", "tipo"))
+        await asyncio.sleep(0)
+        vuelo = main.vuelos_groq[next(iter(main.vuelos_groq))][0]
+        a.cancel()
+        await asyncio.sleep(0)
+
+        # Sin esperar a que la llamada cancelada termine de cancelarse
+        b = asyncio.create_task(main.llamar_groq("hola", "tipo"))
+        await asyncio.sleep(0)
+        listo.set()
+        resultado = await b
+        await asyncio.sleep(0)
+        return resultado, vuelo.cancelled()
+
+    assert asyncio.run(se_van_todos_y_llega_otro()) == ("ok", True)
+    assert llamadas == ["hola", "hola"]
+    assert main.vuelos_groq == {}
+
+
+# ---------- Circuito ----------
+
+def test_circuito_se_abre_tras_el_umbral_de_fallos_seguidos(reloj):
+    circuito = main.CircuitoGroq(umbral=3, espera=30)
+
+    for _ in range(2):
+        circuito.permitir()
+        circuito.fallo()
+    assert circuito.estado == "cerrado"
+
+    # Un éxito reinicia la cuenta
+    circuito.exito()
+    for _ in range(3):
+        circuito.permitir()
+        circuito.fallo()
+    assert circuito.estado == "abierto"
+
+    with pytest.raises(main.GroqNoDisponible):
+        circuito.permitir()
+
+
+def test_circuito_semiabierto_deja_pasar_una_prueba_y_cierra_si_sale_bien(reloj):
+    circuito = main.CircuitoGroq(umbral=1, espera=30)
+    circuito.permitir()
+    circuito.fallo()
+
+    reloj[0] += 29
+    with pytest.raises(main.GroqNoDisponible):
+        circuito.permitir()
+
+    reloj[0] += 2
+    circuito.permitir()
+    assert circuito.estado == "semiabierto"
+    with pytest.raises(main.GroqNoDisponible):
+        circuito.permitir()
+
+    circuito.exito()
+    assert (circuito.estado, circuito.fallos) == ("cerrado", 0)
+    circuito.permitir()
+
+
+def test_circuito_semiabierto_reabre_si_la_prueba_falla(reloj):
+    circuito = main.CircuitoGroq(umbral=5, espera=30)
+    circuito.estado, circuito.abierto_hasta = "abierto", reloj[0]
+
+    circuito.permitir()
+    circuito.fallo()
+    assert circuito.estado == "abierto"
+    assert circuito.abierto_hasta == reloj[0] + 30
+
+
+def test_circuito_una_prueba_cancelada_libera_el_turno(reloj):
+    circuito = main.CircuitoGroq(umbral=1, espera=30)
+    circuito.estado, circuito.abierto_hasta = "abierto", reloj[0]
+
+    circuito.permitir()
+    circuito.liberar_prueba()
+    circuito.permitir()
+    assert circuito.estado == "semiabierto"
+
+
+# ---------- Limitador y cabeceras de Groq ----------
+
+@pytest.mark.parametrize("valor, segundos", [
+    ("2m59.56s", 179.56),
+    ("7.66s", 7.66),
+    ("250ms", 0.25),
+    ("1h", 3600),
+    ("3", 3),
+    ("", None),
+    (None, None),
+    ("pronto", None),
+])
+def test_leer_duracion(valor, segundos):
+    assert main.leer_duracion(valor) == pytest.approx(segundos)
+
+
+def test_un_429_parte_la_tasa_y_pausa_lo_que_diga_retry_after(reloj):
+    limitador = main.LimitadorAdaptativo(rpm=600, espera_max=3)
+
+    limitador.registrar_limite({"retry-after": "7"})
+    assert limitador.tasa == pytest.approx(5)
+    assert limitador.pausa_hasta == reloj[0] + 7
+
+    # Sin retry-after vale el reinicio de tokens
+    limitador.registrar_limite({"x-ratelimit-reset-tokens": "12.5s"})
+    assert limitador.tasa == pytest.approx(2.5)
+    assert limitador.pausa_hasta == reloj[0] + 12.5
+
+
+def test_la_tasa_se_recupera_poco_a_poco_hasta_el_maximo(reloj):
+    limitador = main.LimitadorAdaptativo(rpm=600, espera_max=3)
+    limitador.registrar_limite({})
+
+    limitador.registrar_exito({})
+    assert limitador.tasa == pytest.approx(5.5)
+    for _ in range(20):
+        limitador.registrar_exito({})
+    assert limitador.tasa == pytest.approx(10)
+
+
+def test_sin_peticiones_restantes_se_pausa_hasta_el_reinicio(reloj):
+    limitador = main.LimitadorAdaptativo(rpm=600, espera_max=3)
+
+    limitador.registrar_exito({"x-ratelimit-remaining-requests": "0", "x-ratelimit-reset-requests": "2m"})
+    assert limitador.pausa_hasta == reloj[0] + 120
+
+
+def test_con_pocos_tokens_restantes_se_pausa_hasta_el_reinicio(reloj):
+    limitador = main.LimitadorAdaptativo(rpm=600, espera_max=3)
+
+    limitador.registrar_exito({"x-ratelimit-remaining-tokens": str(main.GROQ_MARGEN_TOKENS + 1)})
+    assert limitador.pausa_hasta == 0
+
+    limitador.registrar_exito({"x-ratelimit-remaining-tokens": "10", "x-ratelimit-reset-tokens": "750ms"})
+    assert limitador.pausa_hasta == pytest.approx(reloj[0] + 0.75)
+
+
+def test_una_pausa_mas_larga_que_la_espera_maxima_va_al_respaldo(reloj):
+    limitador = main.LimitadorAdaptativo(rpm=600, espera_max=3)
+    limitador.pausar(10)
+
+    with pytest.raises(main.GroqNoDisponible):
+        asyncio.run(limitador.esperar())
+
+    reloj[0] += 10
+    asyncio.run(limitador.esperar())
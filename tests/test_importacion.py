@@ -0,0 +1,83 @@
+import asyncio
+
+import pytest
+
+import main
+
+
+class PeticionFalsa:
+    """Sólo lo que procesar_importacion usa de la petición: receive() tras leer el cuerpo."""
+
+    async def receive(self):
+        await asyncio.Event().wait()
+
+
+def nueva_importacion() -> dict:
+    return {
+        "id": "prueba", "usuario": "", "leidas": 0, "procesadas": 0, "clasificadas": 0,
+        "errores": 0, "error": None, "cancelada": asyncio.Event(), "inicio": 0.0
+    }
+
+
+def test_cerrar_la_respuesta_a_media_subida_no_deja_tareas_colgadas(monkeypatch):
+    async def clasificar_lento(*args, **kwargs):
+        await asyncio.Event().wait()
+
+    async def filas():
+        for i in range(1000):
+            yield {"mensaje": f"pague {i + 1} de uber", "monto": None, "fecha": None}, None
+
+    monkeypatch.setattr(main, "clasificar_gasto", clasificar_lento)
+    monkeypatch.setattr(main, "metricas", main.Metricas())
+
+    async def importar_y_desconectar():
+        antes = asyncio.all_tasks()
+        respuesta = main.procesar_importacion(PeticionFalsa(), filas(), "Bearer a", nueva_importacion())
+        siguiente = asyncio.ensure_future(anext(respuesta))
+        # Los trabajadores se atoran y el lector queda esperando con la cola llena
+        await asyncio.sleep(0.05)
+        siguiente.cancel()
+        await asyncio.gather(siguiente, return_exceptions=True)
+        await respuesta.aclose()
+        await asyncio.sleep(0.05)
+        return [t for t in asyncio.all_tasks() - antes if not t.done()]
+
+    assert asyncio.run(asyncio.wait_for(importar_y_desconectar(), 5)) == []
+    # Una importación cortada también cuenta en la latencia de punta a punta
+    assert ("ia_etapa_duracion_segundos", (("etapa", "total_importacion"),)) in main.metricas.histogramas
+
+
+@pytest.mark.parametrize("celda, esperado", [
+    ("150.00", (150.0, None)),
+    ("1,234.50", (1234.5, None)),
+    ("1.234,50", (1234.5, None)),
+    ("$ 1,500", (1500.0, None)),
+    ("-150.00", (150.0, "expense")),
+    ("(150.00)", (150.0, "expense")),
+    ("+5,000.00", (5000.0, "income")),
+])
+def test_el_signo_del_monto_decide_el_tipo(celda, esperado):
+    assert main.leer_monto_celda(celda) == esperado
+
+
+@pytest.mark.parametrize("mensaje, celda, monto", [
+    ("pagué $50.50 de uber", "50.50", 50.5),
+    ("pague 1,500 de renta", "1,500", 1500),
+    ("pague 1.234,50 de luz", "1.234,50", 1234.5),
+    ("Pagué $300 de tacos.", "300", 300),
+    ("me pagaron 2,000.50.", "2,000.50", 2000.5),
+])
+def test_el_monto_del_mensaje_se_lee_igual_que_el_de_la_celda(mensaje, celda, monto):
+    assert main.extraer_monto(mensaje) == main.leer_monto_celda(celda)[0] == monto
+
+
+def test_fila_ndjson_con_monto_negativo_es_gasto():
+    fila = main.armar_fila("transferencia spei", -250, None)
+    assert (fila["monto"], fila["tipo"]) == (250, "expense")
+
+
+def test_el_tipo_por_signo_gana_al_que_dedujo_groq(groq):
+    groq.respuestas.update(tipo='{"type": "income"}', categoria='{"categoria": "Transferencia"}')
+
+    analisis = asyncio.run(main.analizar_mensaje("spei a juan perez", tipo="expense"))
+    assert analisis["type"] == "expense"
@@ -0,0 +1,58 @@
+import asyncio
+
+import main
+
+
+def test_principales_ordena_por_votos_y_desempata_por_lo_reciente():
+    indice = main.IndiceUsuario("u")
+    indice.votar_categoria("Comida", "expense", 3)
+    indice.votar_categoria("Transporte", "expense", 1)
+    indice.votar_categoria("Salario", "income", 1)
+
+    assert indice.principales(2) == ["Comida", "Salario"]
+    assert indice.principales(0) == []
+
+
+def test_el_prompt_de_categoria_muestra_las_del_usuario(groq):
+    asyncio.run(main.clasificar_categoria_IA("pague 80 en indriver", ["Transporte", "Comida"]))
+    assert '["Transporte", "Comida"]' in groq.prompts["categoria"]
+    assert "No uses listas existentes" not in groq.prompts["categoria"]
+
+    asyncio.run(main.clasificar_categoria_IA("pague 80 en indriver"))
+    assert "No uses listas existentes" in groq.prompts["categoria"]
+
+
+def test_con_las_categorias_del_usuario_el_resultado_va_a_su_propia_entrada(groq):
+    asyncio.run(main.analizar_con_groq("pague 80 en indriver", categorias=["Transporte"], usuario="u"))
+
+    assert asyncio.run(main.analizar_sin_red("pague 95 en indriver", usuario="u"))["categoria"] == "Transporte"
+    assert asyncio.run(main.analizar_sin_red("pague 95 en indriver")) is None
+
+
+def test_clasificar_gasto_le_pasa_a_groq_las_categorias_del_usuario(groq, monkeypatch):
+    monkeypatch.setattr(main, "indice_categorias", main.IndiceCategorias(":memory:"))
+    monkeypatch.setattr(main, "BACKEND_URL", None)
+    usuario = main.usuario_de_token("Bearer a")
+    indice = asyncio.run(main.indice_categorias.cargar(usuario))
+    main.indice_categorias.aprender(indice, "pague 50 de uber", "Transporte", "expense")
+
+    resultado = asyncio.run(main.clasificar_gasto("pague 80 en indriver", "Bearer a"))
+
+    assert resultado["category"] == "Transporte"
+    assert '["Transporte"]' in groq.prompts["categoria"]
+
+
+def test_un_usuario_con_categorias_tambien_aprovecha_la_cache(groq, monkeypatch):
+    monkeypatch.setattr(main, "indice_categorias", main.IndiceCategorias(":memory:"))
+    monkeypatch.setattr(main, "BACKEND_URL", None)
+    indice = asyncio.run(main.indice_categorias.cargar(main.usuario_de_token("Bearer a")))
+    main.indice_categorias.aprender(indice, "pague 50 de uber", "Transporte", "expense")
+
+    asyncio.run(main.clasificar_gasto("pague 80 en la tlapaleria", "Bearer a"))
+    llamadas = len(groq.llamadas)
+    asyncio.run(main.clasificar_gasto("pague 95 en la tlapaleria", "Bearer a"))
+    asyncio.run(main.clasificar_gastos(["pague 60 en la tlapaleria"], "Bearer a"))
+
+    assert llamadas > 0
+    assert len(groq.llamadas) == llamadas
+    assert main.cache.estadisticas()["aciertos"] == 2
@@ -0,0 +1,39 @@
+import asyncio
+
+import main
+
+# Ningún léxico los explica: sin Groq no se resuelven local
+MENSAJES = ["pague 300 en la tlapaleria", "pague 120 en la merceria", "pague 80 en la paleteria"]
+
+
+def limitado(etapa):
+    raise main.GroqNoDisponible("Groq respondió 429")
+
+
+def test_groq_no_disponible_en_el_lote_usa_el_respaldo_local_sin_mas_llamadas(groq):
+    groq.respuestas["lote"] = limitado
+    conocidas = [None, ("Hogar", "expense"), None]
+    resultados = asyncio.run(main.analizar_lote_con_groq(MENSAJES, conocidas))
+
+    assert groq.llamadas == ["lote"]
+    assert all(r["degradado"] for r in resultados)
+    assert [r["categoria"] for r in resultados] == ["SinCategoria", "Hogar", "SinCategoria"]
+
+
+def test_respuesta_de_lote_invalida_se_pregunta_uno_por_uno(groq):
+    groq.respuestas.update(lote="no es json", categoria='{"categoria": "Hogar"}')
+    resultados = asyncio.run(main.analizar_lote_con_groq(MENSAJES))
+
+    assert groq.llamadas.count("lote") == 1
+    assert groq.llamadas.count("categoria") == len(MENSAJES)
+    assert [(r["categoria"], r["degradado"]) for r in resultados] == [("Hogar", False)] * len(MENSAJES)
+
+
+def test_clasificar_gastos_conserva_el_error_de_monto_de_cada_mensaje(groq, monkeypatch):
+    groq.respuestas = dict.fromkeys([*groq.respuestas, "lote"], limitado)
+    monkeypatch.setattr(main, "BACKEND_URL", None)
+    mensajes = ["pague 0 de algo raro", "pague 0 de uber", "pague de algo raro"]
+    resultados = asyncio.run(main.clasificar_gastos(mensajes, "Bearer a"))
+
+    # Los mismos errores que da /clasificar_gasto con cada mensaje
+    assert [r["error"] for r in resultados] == ["Monto inválido", "Monto inválido", "No se encontró monto"]
@@ -0,0 +1,53 @@
+import asyncio
+
+import main
+
+
+def test_exportar_acumula_las_cubetas_y_cierra_con_sum_y_count():
+    metricas = main.Metricas()
+    for valor in (0.003, 0.003, 0.2, 60):
+        metricas.observar("ia_etapa_duracion_segundos", valor, etapa="groq")
+
+    lineas = metricas.exportar([]).splitlines()
+
+    assert lineas[:2] == [
+        "# HELP ia_etapa_duracion_segundos Latencia de cada etapa de la clasificación",
+        "# TYPE ia_etapa_duracion_segundos histogram"
+    ]
+    assert 'ia_etapa_duracion_segundos_bucket{etapa="groq",le="0.0025"} 0' in lineas
+    assert 'ia_etapa_duracion_segundos_bucket{etapa="groq",le="0.005"} 2' in lineas
+    assert 'ia_etapa_duracion_segundos_bucket{etapa="groq",le="0.25"} 3' in lineas
+    assert 'ia_etapa_duracion_segundos_bucket{etapa="groq",le="10"} 3' in lineas
+    assert 'ia_etapa_duracion_segundos_bucket{etapa="groq",le="+Inf"} 4' in lineas
+    assert lineas[-2:] == [
+        'ia_etapa_duracion_segundos_sum{etapa="groq"} 60.206000',
+        'ia_etapa_duracion_segundos_count{etapa="groq"} 4'
+    ]
+
+
+def test_exportar_escapa_las_etiquetas_y_no_repite_encabezados():
+    metricas = main.Metricas()
+    metricas.contar("ia_respaldos_total", campo='di "hola"\\\nadios')
+    metricas.contar("ia_respaldos_total", 2, campo="tipo")
+
+    lineas = metricas.exportar([("cache_entradas", "gauge", "Entradas en caché", {}, 3)]).splitlines()
+
+    assert lineas == [
+        "# HELP ia_respaldos_total Campos resueltos con el respaldo local porque Groq falló",
+        "# TYPE ia_respaldos_total counter",
+        'ia_respaldos_total{campo="di \\"hola\\"\\\\\\nadios"} 1',
+        'ia_respaldos_total{campo="tipo"} 2',
+        "# HELP cache_entradas Entradas en caché",
+        "# TYPE cache_entradas gauge",
+        "cache_entradas 3"
+    ]
+
+
+def test_el_lote_mide_su_latencia_de_punta_a_punta(groq, monkeypatch):
+    monkeypatch.setattr(main, "metricas", main.Metricas())
+    monkeypatch.setattr(main, "BACKEND_URL", None)
+    payload = [main.MensajeUsuario(mensaje="pague 80 de uber")]
+
+    asyncio.run(main.clasificar_lote_endpoint(payload, "Bearer a"))
+
+    assert ("ia_etapa_duracion_segundos", (("etapa", "total_lote"),)) in main.metricas.histogramas
@@ -0,0 +1,147 @@
+import pytest
+
+import main
+
+
+@pytest.fixture
+def outbox(tmp_path, monkeypatch):
+    # Sin espera entre reintentos: lo reintentado vuelve a estar vencido al instante
+    monkeypatch.setattr(main, "OUTBOX_BACKOFF_BASE", 0)
+    monkeypatch.setattr(main, "OUTBOX_TAMANO_LOTE", 1)
+    caja = main.Outbox(str(tmp_path / "outbox.db"))
+    yield caja
+    caja.cerrar()
+
+
+def transaccion(n: int) -> dict:
+    return {"type": "expense", "amount": n, "category": "Comida"}
+
+
+def por_envio(envios) -> dict[str, list[int]]:
+    return {envio: [fila[0] for fila in filas] for envio, _, filas in envios}
+
+
+def estado_filas(outbox: main.Outbox) -> dict[int, tuple]:
+    filas = outbox._conn.execute("SELECT id, estado, intentos, token FROM outbox").fetchall()
+    return {id_: (estado, intentos, token) for id_, estado, intentos, token in filas}
+
+
+def test_reclamar_reserva_cada_fila_suelta_una_sola_vez(outbox):
+    ids = outbox.encolar([transaccion(1), transaccion(2)], "Bearer a")
+
+    envios = outbox.reclamar(100)
+    assert sorted(por_envio(envios).values()) == [[ids[0]], [ids[1]]]
+    assert {token for _, token, _ in envios} == {"Bearer a"}
+    assert envios[0][2][0][1] == transaccion(1)
+
+    # Reservadas: otro worker no las toma hasta que venza la reserva
+    assert outbox.reclamar(100) == []
+
+
+def test_un_lote_se_envia_fila_por_fila_si_no_se_permiten_listas(outbox):
+    ids = outbox.encolar([transaccion(n) for n in range(3)], "Bearer a", agrupar=True)
+
+    envios = outbox.reclamar(100)
+    assert sorted(por_envio(envios).values()) == [[i] for i in ids]
+
+
+def test_reclamar_toma_el_lote_completo_aunque_pase_del_limite(outbox, monkeypatch):
+    monkeypatch.setattr(main, "OUTBOX_TAMANO_LOTE", 10)
+    suelta = outbox.encolar([transaccion(0)], "Bearer a")
+    ids = outbox.encolar([transaccion(n) for n in range(5)], "Bearer a", agrupar=True)
+
+    # El lote no se mezcla con la suelta del mismo token
+    envios = outbox.reclamar(2)
+    assert sorted(por_envio(envios).values()) == [suelta, ids]
+
+
+def test_las_sueltas_se_agrupan_por_token_hasta_el_tamano_de_lote(outbox, monkeypatch):
+    monkeypatch.setattr(main, "OUTBOX_TAMANO_LOTE", 2)
+    a = outbox.encolar([transaccion(n) for n in range(3)], "Bearer a")
+    b = outbox.encolar([transaccion(3)], "Bearer b")
+
+    envios = outbox.reclamar(100)
+    assert sorted(por_envio(envios).values()) == sorted([a[:2], a[2:], b])
+
+
+def test_un_reintento_manda_las_mismas_filas_con_la_misma_clave(outbox, monkeypatch):
+    monkeypatch.setattr(main, "OUTBOX_TAMANO_LOTE", 2)
+    outbox.encolar([transaccion(n) for n in range(3)], "Bearer a")
+    primeros = por_envio(outbox.reclamar(100))
+
+    for ids in primeros.values():
+        outbox.reintentar(ids, 0, "HTTP 503")
+    # Una fila nueva no se mete en los envíos ya decididos
+    nueva = outbox.encolar([transaccion(3)], "Bearer a")
+
+    segundos = por_envio(outbox.reclamar(100))
+    assert {k: v for k, v in segundos.items() if k in primeros} == primeros
+    assert [v for k, v in segundos.items() if k not in primeros] == [nueva]
+
+
+def test_el_limite_no_parte_un_envio_ya_decidido(outbox, monkeypatch):
+    monkeypatch.setattr(main, "OUTBOX_TAMANO_LOTE", 3)
+    outbox.encolar([transaccion(n) for n in range(3)], "Bearer a")
+    (envio, ids), = por_envio(outbox.reclamar(100)).items()
+    outbox.reintentar(ids, 0, "HTTP 503")
+
+    assert por_envio(outbox.reclamar(1)) == {envio: ids}
+
+
+def test_una_reserva_vencida_se_vuelve_a_reclamar_con_su_envio(outbox, monkeypatch):
+    outbox.encolar([transaccion(1)], "Bearer a")
+    primeros = por_envio(outbox.reclamar(100))
+
+    # El worker que la reservó se cayó sin confirmar ni reintentar
+    monkeypatch.setattr(main.time, "time", lambda: 10 ** 12)
+    assert por_envio(outbox.reclamar(100)) == primeros
+
+
+def test_confirmar_borra_las_filas(outbox):
+    ids = outbox.encolar([transaccion(1)], "Bearer a")
+    outbox.reclamar(100)
+
+    outbox.confirmar(ids)
+    assert estado_filas(outbox) == {}
+    assert outbox.estado()["enviados"] == 1
+
+
+def test_reintentar_vuelve_a_pendiente_y_cuenta_el_intento(outbox):
+    ids = outbox.encolar([transaccion(1)], "Bearer a")
+    outbox.reclamar(100)
+
+    outbox.reintentar(ids, 0, "HTTP 503")
+    assert estado_filas(outbox) == {ids[0]: ("pendiente", 1, "Bearer a")}
+    assert outbox.estado()["ultimo_error"] == "HTTP 503"
+
+
+def test_al_agotar_los_intentos_queda_fallida_y_sin_token(outbox, monkeypatch):
+    monkeypatch.setattr(main, "OUTBOX_MAX_INTENTOS", 2)
+    ids = outbox.encolar([transaccion(1)], "Bearer a")
+
+    outbox.reclamar(100)
+    outbox.reintentar(ids, 0, "HTTP 503")
+    outbox.reclamar(100)
+    outbox.reintentar(ids, 1, "HTTP 503")
+
+    assert estado_filas(outbox) == {ids[0]: ("fallido", 2, "")}
+    assert outbox.reclamar(100) == []
+    assert outbox.estado()["fallidos"] == 1
+
+
+def test_un_rechazo_definitivo_falla_al_primer_intento(outbox):
+    ids = outbox.encolar([transaccion(1)], "Bearer a")
+    outbox.reclamar(100)
+
+    outbox.reintentar(ids, 0, "HTTP 422", definitivo=True)
+    assert estado_filas(outbox) == {ids[0]: ("fallido", 1, "")}
+
+
+def test_purgar_borra_las_fallidas_viejas(outbox, monkeypatch):
+    ids = outbox.encolar([transaccion(1)], "Bearer a")
+    outbox.reclamar(100)
+    outbox.reintentar(ids, 0, "HTTP 422", definitivo=True)
+
+    monkeypatch.setattr(main.time, "time", lambda: 10 ** 12)
+    outbox.purgar_fallidos()
+    assert estado_filas(outbox) == {}